@@ -0,0 +1,228 @@
+"""
+A local stand-in for the Intacct XML gateway, serving synthetic responses
+to getAPISession, readByQuery, readMore, inspect, create, update and
+delete.  Every object has 'records' records with the fields in FIELDS.
+
+Run on its own with:
+
+    python -m benchmarks.gateway --port 8080 --records 100000
+
+The first line printed is the URL of the gateway.
+"""
+
+try:
+    import xml.etree.cElementTree as ET
+except ImportError:
+    import xml.etree.ElementTree as ET
+
+import argparse
+import csv
+import io
+import itertools
+import json
+import sys
+import threading
+import time
+from xml.sax.saxutils import escape
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+# Fields of the synthetic objects: (name, externalDataName)
+FIELDS = (
+    ('RECORDNO', 'integer'),
+    ('VENDORID', 'string'),
+    ('NAME', 'string'),
+    ('STATUS', 'string'),
+    ('TOTALDUE', 'currency'),
+    ('ONHOLD', 'boolean'),
+    ('WHENMODIFIED', 'timestamp'),
+)
+# Nested fields of the synthetic objects, as 'OBJECT.FIELD'
+NESTED = ('CONTACTINFO.EMAIL1', 'CONTACTINFO.PHONE1')
+# (isRequired, isReadOnly, maxLength) of the fields which are not
+# ('false', 'false', '0')
+ATTRIBUTES = {
+    'RECORDNO': ('false', 'true', '0'),
+    'VENDORID': ('true', 'false', '20'),
+    'NAME': ('true', 'false', '100'),
+    'WHENMODIFIED': ('false', 'true', '0'),
+    'CONTACTINFO.EMAIL1': ('false', 'false', '80'),
+}
+
+
+def record(tag, n):
+    return (
+        '<{0}><RECORDNO>{1}</RECORDNO><VENDORID>V{1}</VENDORID>'
+        '<NAME>Vendor number {1}</NAME><STATUS>active</STATUS>'
+        '<TOTALDUE>{1}.25</TOTALDUE><ONHOLD>false</ONHOLD>'
+        '<WHENMODIFIED>01/02/2020 10:00:00</WHENMODIFIED>'
+        '<CONTACTINFO><EMAIL1>v{1}@example.com</EMAIL1>'
+        '<PHONE1>555-{1}</PHONE1></CONTACTINFO></{0}>'
+    ).format(tag, n)
+
+
+def values(n):
+    return [
+        ('RECORDNO', str(n)), ('VENDORID', 'V%d' % n),
+        ('NAME', 'Vendor number %d' % n), ('STATUS', 'active'),
+        ('TOTALDUE', '%d.25' % n), ('ONHOLD', 'false'),
+        ('WHENMODIFIED', '01/02/2020 10:00:00'),
+        ('CONTACTINFO.EMAIL1', 'v%d@example.com' % n),
+        ('CONTACTINFO.PHONE1', '555-%d' % n),
+    ]
+
+
+def records(tag, numbers, return_format):
+    """
+    Return the text of a 'data' element holding the records 'numbers' in
+    'return_format'.
+    """
+    if return_format == 'json':
+        return escape(json.dumps(
+            [dict(values(n)) for n in numbers], separators=(',', ':')))
+    if return_format == 'csv':
+        out = io.StringIO() if str is not bytes else io.BytesIO()
+        writer = csv.writer(out)
+        writer.writerow([name for name, value in values(0)])
+        for n in numbers:
+            writer.writerow([value for name, value in values(n)])
+        return escape(out.getvalue())
+    return ''.join(record(tag, n) for n in numbers)
+
+
+def type_definition(name):
+    fields = list(FIELDS) + [(f, 'string') for f in NESTED]
+    return '<Type Name="%s"><Fields>%s</Fields></Type>' % (name, ''.join(
+        '<Field><Name>%s</Name><externalDataName>%s</externalDataName>'
+        '<isRequired>%s</isRequired><isReadOnly>%s</isReadOnly>'
+        '<maxLength>%s</maxLength></Field>' % (
+            (f, t) + ATTRIBUTES.get(f, ('false', 'false', '0')))
+        for f, t in fields))
+
+
+class Gateway(ThreadingMixIn, HTTPServer):
+    """
+    The stand-in gateway.  'latency' seconds are added to every response.
+    Query cursors are kept in memory until their last page is read.
+    """
+    daemon_threads = True
+
+    def __init__(self, port=0, records=10000, latency=0.0):
+        HTTPServer.__init__(self, ('127.0.0.1', port), _Handler)
+        self.records = records
+        self.latency = latency
+        self.cursors = {}
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+        self.thread = None
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d/ia/xml/xmlgw.phtml' % self.server_port
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def function(self, function):
+        """
+        Return the 'data' for a function element, or None for failure.
+        """
+        tag = function.tag
+        if tag == 'getAPISession':
+            return ('<data><api><sessionid>session%d</sessionid>'
+                    '<endpoint>%s</endpoint></api></data>' % (
+                        next(self.ids), self.url))
+        if tag == 'readByQuery':
+            obj = function.findtext('object')
+            size = int(function.findtext('pagesize') or 100)
+            return_format = function.findtext('returnFormat') or 'xml'
+            with self.lock:
+                result_id = 'result%d' % next(self.ids)
+                self.cursors[result_id] = [obj, size, return_format, 1]
+            return self.page(result_id)
+        if tag == 'readMore':
+            return self.page(function.findtext('resultId'))
+        if tag == 'inspect':
+            name = function.findtext('object') or function.findtext('name')
+            return '<data>%s</data>' % type_definition(name.upper())
+        if tag in ('create', 'update', 'delete'):
+            return '<data/>'
+        return None
+
+    def page(self, result_id):
+        with self.lock:
+            cursor = self.cursors.get(result_id)
+            if cursor is None:
+                return None
+            obj, size, return_format, start = cursor
+            end = min(self.records + 1, start + size)
+            cursor[3] = end
+            remaining = self.records + 1 - end
+            if not remaining:
+                del self.cursors[result_id]
+        return (
+            '<data listtype="%s" count="%d" totalcount="%d" '
+            'numremaining="%d" resultId="%s">%s</data>' % (
+                obj, end - start, self.records, remaining, result_id,
+                records(obj, range(start, end), return_format)))
+
+    def respond(self, body):
+        request = ET.fromstring(body)
+        results = []
+        for function in request.findall('operation/content/function'):
+            data = self.function(function[0])
+            results.append(
+                '<result><status>%s</status><function>%s</function>'
+                '<controlid>%s</controlid>%s</result>' % (
+                    'failure' if data is None else 'success',
+                    function[0].tag, function.get('controlid'), data or ''))
+        return (
+            '<?xml version="1.0" encoding="UTF-8"?><response><control>'
+            '<status>success</status></control><operation><authentication>'
+            '<status>success</status></authentication>%s</operation>'
+            '</response>' % ''.join(results)).encode('utf-8')
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        response = self.server.respond(body)
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/xml')
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--records', type=int, default=10000)
+    parser.add_argument('--latency', type=float, default=0.0)
+    args = parser.parse_args()
+    gateway = Gateway(args.port, args.records, args.latency)
+    print(gateway.url)
+    sys.stdout.flush()
+    gateway.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
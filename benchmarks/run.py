@@ -0,0 +1,292 @@
+"""
+Benchmarks of the intacct package against the stand-in gateway in
+benchmarks.gateway, which runs in a separate process.  Each benchmark is
+run a number of times and reports its throughput, the percentiles of its
+run times and of the gateway requests it made, and its peak Python
+memory use.
+
+    python -m benchmarks.run --records 20000 --latency 0.02
+    python -m benchmarks.run pagination_stream bulk_create --json
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from intacct.api import IntacctApi
+from intacct.metrics import Metrics
+from .gateway import FIELDS
+
+timer = getattr(time, 'perf_counter', time.time)
+
+# Benchmarks by name, in the order they are run
+BENCHMARKS = OrderedDict()
+
+
+def benchmark(fn):
+    """
+    Register a benchmark.  It is called with the Context and returns a
+    function running one iteration, which returns the number of items
+    (records or objects) it processed.
+    """
+    BENCHMARKS[fn.__name__] = fn
+    return fn
+
+
+def percentile(values, p):
+    """
+    Return the nearest rank 'p' percentile of 'values'.
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    rank = int(round(p / 100.0 * len(values) + 0.5)) - 1
+    return values[min(max(rank, 0), len(values) - 1)]
+
+
+class Context(object):
+    """
+    The options, the gateway URL and an API factory shared by the
+    benchmarks.  Every request made through an API from api() is timed.
+    """
+    def __init__(self, args, url):
+        self.args = args
+        self.url = url
+        self.requests = []
+        self.metrics = Metrics(callbacks=[self._request])
+
+    def _request(self, call):
+        self.requests.append(call.network + call.parse)
+
+    def api(self, **kwargs):
+        api = IntacctApi(
+            senderid='bench', senderpass='bench', userid='bench',
+            userpass='bench', companyid='bench', url=self.url,
+            metrics=self.metrics, **kwargs)
+        api.get_api_session()
+        return api
+
+
+@benchmark
+def pagination(ctx):
+    api = ctx.api()
+
+    def run():
+        return len(api.read_by_query(
+            'VENDOR', pagesize=ctx.args.page_size,
+            return_format=ctx.args.format))
+    return run
+
+
+@benchmark
+def pagination_stream(ctx):
+    api = ctx.api()
+
+    def run():
+        n = 0
+        for record in api.iter_by_query(
+                'VENDOR', pagesize=ctx.args.page_size,
+                return_format=ctx.args.format):
+            n += 1
+        return n
+    return run
+
+
+@benchmark
+def pagination_columns(ctx):
+    api = ctx.api()
+
+    def run():
+        columns = api.read_by_query(
+            'VENDOR', pagesize=ctx.args.page_size,
+            return_format=ctx.args.format, as_columns=True)
+        return columns.rows
+    return run
+
+
+@benchmark
+def pagination_compact(ctx):
+    api = ctx.api()
+
+    def run():
+        return len(api.read_by_query(
+            'VENDOR', pagesize=ctx.args.page_size,
+            return_format=ctx.args.format, compact=True))
+    return run
+
+
+@benchmark
+def bulk_create(ctx):
+    from intacct.objfactory import ObjectFactory
+    api = ctx.api(max_workers=ctx.args.workers)
+
+    def run():
+        records = []
+        for n in range(ctx.args.writes):
+            vendor = ObjectFactory('VENDOR')
+            vendor.VENDORID = 'V%d' % n
+            vendor.NAME = 'Vendor number %d' % n
+            vendor.CONTACTINFO.EMAIL1 = 'v%d@example.com' % n
+            records.append(vendor)
+        report = api.bulk_create(records)
+        assert report.ok
+        return len(report.succeeded)
+    return run
+
+
+@benchmark
+def objfactory_serialize(ctx):
+    from intacct.objfactory import ObjectFactory
+    from intacct.request import ET
+
+    def run():
+        for n in range(ctx.args.writes):
+            vendor = ObjectFactory('VENDOR')
+            vendor.VENDORID = 'V%d' % n
+            vendor.NAME = 'Vendor number %d' % n
+            vendor.TOTALDUE = n
+            vendor.CONTACTINFO.EMAIL1 = 'v%d@example.com' % n
+            ET.tostring(vendor())
+        return ctx.args.writes
+    return run
+
+
+@benchmark
+def objcache_load(ctx):
+    from intacct.objcache import ObjectCache
+
+    def run():
+        cache = ObjectCache()
+        cache.load()
+        return len(cache.index)
+    return run
+
+
+@benchmark
+def objcache_lookup(ctx):
+    from intacct.objcache import ObjectCache
+
+    def run():
+        cache = ObjectCache()
+        cache['VENDOR']
+        return 1
+    return run
+
+
+def measure(ctx, name, setup):
+    """
+    Run a benchmark and return its results.
+    """
+    run = setup(ctx)
+    run()
+    del ctx.requests[:]
+    times = []
+    items = 0
+    for i in range(ctx.args.repeat):
+        start = timer()
+        items += run()
+        times.append(timer() - start)
+    requests = list(ctx.requests)
+    peak = None
+    if tracemalloc is not None:
+        tracemalloc.start()
+        run()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    result = OrderedDict([
+        ('name', name),
+        ('items_per_second', items / sum(times)),
+        ('requests', len(requests)),
+    ])
+    for label, values in (('run', times), ('request', requests)):
+        for p in (50, 90, 99):
+            result['%s_p%d_ms' % (label, p)] = \
+                None if not values else percentile(values, p) * 1000
+    result['peak_memory_kb'] = None if peak is None else peak // 1024
+    return result
+
+
+def table(results):
+    columns = list(results[0])
+    rows = [columns] + [
+        ['-' if v is None else
+         ('%.1f' % v if isinstance(v, float) else str(v))
+         for v in result.values()]
+        for result in results
+    ]
+    widths = [max(len(row[i]) for row in rows) for i in range(len(columns))]
+    return '\n'.join(
+        '  '.join(cell.rjust(width) if i else cell.ljust(width)
+                  for i, (cell, width) in enumerate(zip(row, widths)))
+        for row in rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('benchmarks', nargs='*', metavar='benchmark',
+                        help='benchmarks to run (default: all of %s)' %
+                        ', '.join(BENCHMARKS))
+    parser.add_argument('--records', type=int, default=10000,
+                        help='records served per query')
+    parser.add_argument('--page-size', type=int, default=1000)
+    parser.add_argument('--format', default='xml',
+                        choices=('xml', 'json', 'csv'),
+                        help='returnFormat of the pagination benchmarks')
+    parser.add_argument('--writes', type=int, default=2000,
+                        help='objects created per iteration')
+    parser.add_argument('--objects', type=int, default=200,
+                        help='object types in the ObjectCache')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds added to every response')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--json', action='store_true',
+                        help='print the results as JSON')
+    args = parser.parse_args(argv)
+    names = args.benchmarks or list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            parser.error('unknown benchmark: %s' % name)
+
+    # Keep the ObjectCache of the current user out of the way.
+    home = tempfile.mkdtemp()
+    os.environ['HOME'] = home
+    gateway = subprocess.Popen(
+        [sys.executable, '-m', 'benchmarks.gateway', '--port', '0',
+         '--records', str(args.records), '--latency', str(args.latency)],
+        stdout=subprocess.PIPE)
+    try:
+        url = gateway.stdout.readline().decode('ascii').strip()
+        ctx = Context(args, url)
+        from intacct.objcache import ObjectCache
+        objects = ['VENDOR'] + ['OBJECT%d' % n for n in range(args.objects)]
+        ObjectCache().initialize(ctx.api(max_workers=args.workers), objects)
+        results = [measure(ctx, name, BENCHMARKS[name]) for name in names]
+    finally:
+        gateway.terminate()
+        gateway.wait()
+        shutil.rmtree(home)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print("%d records, %d fields, page size %d, %s, latency %gs" % (
+            args.records, len(FIELDS), args.page_size, args.format,
+            args.latency))
+        print(table(results))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,145 @@
+"""
+intacct.aio
+~~~~~~~~~~~
+
+This module implements an asyncio client for the Intacct API.  It shares
+envelope building and response parsing with the synchronous client and
+requires Python 3.6 or later.
+
+"""
+
+import asyncio
+from .api import _Functions, _read_by_query, _read_more
+from . import default
+from .metrics import Call, function_name, timer
+from .request import Envelope, ResponseParser, headers
+
+
+class AiohttpTransport(object):
+    """
+    Post requests using aiohttp, which must be installed.  A transport is
+    any object with a coroutine post(url, data, headers) returning the
+    HTTP status code and the response body, plus a coroutine close().
+    """
+    def __init__(self, limit=None):
+        import aiohttp
+        self.aiohttp = aiohttp
+        self.limit = limit or default.max_concurrency
+        self.session = None
+
+    async def post(self, url, data, headers):
+        if self.session is None:
+            connector = self.aiohttp.TCPConnector(limit=self.limit)
+            self.session = self.aiohttp.ClientSession(connector=connector)
+        async with self.session.post(url, data=data, headers=headers) as r:
+            return r.status, await r.read()
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+
+class AsyncIntacctApi(_Functions):
+    """
+    asyncio version of IntacctApi.  The gateway functions are coroutines:
+
+        api = AsyncIntacctApi(senderid=..., ...)
+        await api.get_api_session()
+        data = await api.read('VENDOR', 1)
+        async for record in api.iter_by_query('VENDOR'):
+            ...
+    """
+    def __init__(self, transport=None, max_concurrency=None, **kwargs):
+        """
+        Constructor for API instance.
+
+        Keyword arguments:
+            transport        Optional. The HTTP transport; defaults to an
+                             AiohttpTransport.
+            max_concurrency  Optional. The number of calls which may be in
+                             flight at once.
+            metrics          Optional. A Metrics object recording timings
+                             and sizes of each call.
+
+        The credentials are the same as for IntacctApi.
+        """
+        self.request = Envelope(**kwargs)
+        self.metrics = kwargs.get('metrics')
+        self.transport = transport or AiohttpTransport(max_concurrency)
+        self.semaphore = asyncio.Semaphore(
+            max_concurrency or default.max_concurrency)
+
+    async def _post(self, functions, stream=False):
+        call = None
+        if self.metrics is not None:
+            call = Call(self.metrics, function_name(functions))
+            start = timer()
+        url, xmltext = self.request.envelope(functions)
+        if call is not None:
+            call.serialize = timer() - start
+            call.request_bytes = len(xmltext)
+        ok = False
+        try:
+            async with self.semaphore:
+                if call is not None:
+                    sent = timer()
+                status, body = await self.transport.post(
+                    url, xmltext, headers)
+                if call is not None:
+                    call.network = timer() - sent
+            parser = ResponseParser(status, stream, call=call)
+            if not 200 <= status < 300:
+                raise parser.error(body)
+            records = parser.feed(body)
+            parser.close()
+            ok = True
+        finally:
+            if call is not None:
+                call.done(ok)
+        return parser, records
+
+    async def _call(self, element, handler=None):
+        functions = [(self.request.controlid, element)]
+        parser, records = await self._post(functions)
+        if handler is None:
+            return parser.root
+        return handler(parser.root.find('operation/result'))
+
+    async def close(self):
+        await self.transport.close()
+
+    async def read_by_query(self, *args, **kwargs):
+        """
+        Read records using a query; see IntacctApi.read_by_query.
+        """
+        data = None
+        async for page in self.iter_by_query(*args, pages=True, **kwargs):
+            if data is None:
+                data = page
+            else:
+                data.extend(page)
+        return data
+
+    async def iter_by_query(self, *args, **kwargs):
+        """
+        Asynchronous iterator over the records of a query; see
+        IntacctApi.iter_by_query.
+        """
+        pages = kwargs.pop('pages', False)
+        element = _read_by_query(*args, **kwargs)
+        obj = args[0]
+        while True:
+            parser, records = await self._post(
+                [(self.request.controlid, element)], stream=not pages)
+            data = parser.data
+            if pages:
+                if data is None:
+                    break
+                yield data
+            else:
+                for record in records:
+                    yield record
+            if data is None or int(data.attrib.get('numremaining', 0)) <= 0:
+                break
+            element = _read_more(obj, data.attrib.get('resultId'))
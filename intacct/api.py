@@ -12,10 +12,36 @@ except ImportError:
     import xml.etree.ElementTree as ET
 
 import logging
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from functools import partial
+try:
+    from queue import Queue, Full
+except ImportError:
+    from Queue import Queue, Full
+from concurrent.futures import Future, ThreadPoolExecutor
 log = logging.getLogger(__name__)
-from .request import IntacctRequest
-from .default import page_size, max_page_size
+from .request import IntacctRequest, grow_pool, tostring
+from .resultcache import cache_key, written
+from .rows import compact
+from .bulk import BulkReport, chunked
+from .columns import Columns, schema
+from .formats import formats
+from .loader import Loader
+from .metrics import function_name
+from .exceptions import AuthenticationError, TransportError
+from .default import page_size, max_page_size, max_functions, \
+    max_records, max_workers, export_partitions, partition_probes
 from .types import IntacctObjectType
+from .validation import validators
+
+
+# Functions which may safely be repeated
+_idempotent = ('getAPISession', 'inspect', 'read', 'readByName',
+               'readByQuery')
 
 
 def objToEl(el, objects):
@@ -25,44 +51,332 @@ def objToEl(el, objects):
     """
     assert ET.iselement(el)
     for obj in objects:
-        if isinstance(obj, IntacctObjectType):
-            obj = obj()
-        elif isinstance(obj, str):
-            obj = ET.fromstring(obj)
-        if not ET.iselement(obj):
-            raise Exception('Unable to process object: %s' % str(obj))
-        el.append(obj)
+        el.append(_to_element(obj))
 
 
-class IntacctApi(object):
-    def __init__(self, **kwargs):
+def _to_element(obj):
+    if isinstance(obj, IntacctObjectType):
+        obj = obj()
+    elif isinstance(obj, str):
+        obj = ET.fromstring(obj)
+    if not ET.iselement(obj):
+        raise Exception('Unable to process object: %s' % str(obj))
+    return obj
+
+
+def _element(tag):
+    """
+    Return a function which creates a 'tag' element holding the objects it
+    is passed.
+    """
+    def build(objects):
+        el = ET.Element(tag)
+        objToEl(el, objects)
+        return el
+    return build
+
+
+def _success(result):
+    return True
+
+
+def _data(result):
+    return result.find('data')
+
+
+def _rows(result):
+    data = result.find('data')
+    return list(compact(data)) if data is not None else []
+
+
+def _read_by_query(*args, **kwargs):
+    """
+    Create a 'readByQuery' element (see IntacctApi.read_by_query).
+    """
+    assert args
+    obj = args[0]
+    pagesize = kwargs.get('pagesize') or page_size
+    pagesize = pagesize <= max_page_size and pagesize or page_size
+    return_format = kwargs.get('return_format') or 'xml'
+    assert return_format in formats
+    readbyquery = ET.Element('readByQuery')
+    ET.SubElement(readbyquery, 'object').text = obj
+    ET.SubElement(readbyquery, 'fields').text = kwargs.get('fields') or '*'
+    ET.SubElement(readbyquery, 'query').text = kwargs.get('query') or ''
+    ET.SubElement(readbyquery, 'returnFormat').text = return_format
+    ET.SubElement(readbyquery, 'pagesize').text = str(pagesize)
+    return readbyquery
+
+
+def _read_more(obj, result_id=None):
+    """
+    Create a 'readMore' element to continue a query on 'obj'.  When the
+    query returned a 'resultId' it identifies the query instead, so that
+    several queries on the same object can be read at once.
+    """
+    readmore = ET.Element('readMore')
+    if result_id:
+        ET.SubElement(readmore, 'resultId').text = result_id
+    else:
+        ET.SubElement(readmore, 'object').text = obj
+    return readmore
+
+
+def _partition_queries(query, key, bounds):
+    """
+    Split 'query' into len(bounds) + 1 queries on disjoint ranges of 'key'
+    which together cover every record.
+    """
+    def value(v):
+        if isinstance(v, (int, float)):
+            return str(v)
+        return "'%s'" % str(v).replace("'", "''")
+    ranges = []
+    lower = None
+    for bound in list(bounds) + [None]:
+        conditions = []
+        if lower is not None:
+            conditions.append('%s >= %s' % (key, value(lower)))
+        if bound is not None:
+            conditions.append('%s < %s' % (key, value(bound)))
+        ranges.append(' AND '.join(conditions))
+        lower = bound
+    if query:
+        return ['(%s) AND %s' % (query, r) if r else query for r in ranges]
+    return ranges
+
+
+def _bracket(pred, start, step, limit=62):
+    """
+    Return the first x of start, start + step, start + 3 * step, ... (the
+    step doubling each time) for which pred(x) is true, or None after
+    'limit' tries.
+    """
+    x = start
+    for i in range(limit):
+        if pred(x):
+            return x
+        x += step
+        step *= 2
+    return None
+
+
+def _bisect(below, lo, hi, target, tolerance, probes):
+    """
+    Return an integer x in (lo, hi] for which below(x) is within
+    'tolerance' of 'target', or the closest found in 'probes' calls, given
+    that below is non-decreasing and below(lo) < target <= below(hi).
+    """
+    for i in range(probes):
+        if hi - lo <= 1:
+            break
+        mid = (lo + hi) // 2
+        n = below(mid)
+        if abs(n - target) <= tolerance:
+            return mid
+        if n >= target:
+            hi = mid
+        else:
+            lo = mid
+    return hi
+
+
+# Marks the end of the items of a source in fan_in
+_end = object()
+
+
+def fan_in(executor, sources, buffered=page_size):
+    """
+    Generator which runs each of 'sources', (tag, fn) pairs where fn()
+    returns an iterable, on 'executor' and yields (tag, item) pairs as
+    the items arrive from any of them.  Up to 'buffered' items per source
+    are read ahead.  If a source fails, its exception is raised once the
+    items received before it have been yielded.  Closing the generator
+    stops the sources at their next item.
+    """
+    items = Queue(maxsize=buffered * len(sources))
+    done = threading.Event()
+
+    def put(item):
+        while not done.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except Full:
+                pass
+        return False
+
+    def read(tag, fn):
+        try:
+            for item in fn():
+                if not put((tag, item, None)):
+                    return
+        except Exception as e:
+            put((tag, _end, e))
+            return
+        put((tag, _end, None))
+
+    try:
+        for tag, fn in sources:
+            executor.submit(read, tag, fn)
+        running = len(sources)
+        while running:
+            tag, item, error = items.get()
+            if error is not None:
+                raise error
+            if item is _end:
+                running -= 1
+            else:
+                yield tag, item
+    finally:
+        done.set()
+
+
+class _Resume(object):
+    """
+    Follows the RECORDNO of the records of a query, so that a query whose
+    results stop part way through can be run again for the records after
+    the last one received.  This relies on the gateway returning records
+    in RECORDNO order; a query whose records are not in that order, or do
+    not include RECORDNO, is not resumed.
+    """
+    def __init__(self, args, kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        self.last = None
+        self.ordered = True
+        self.resumes = 0
+
+    @property
+    def received(self):
+        return self.last is not None
+
+    def see(self, recordno):
         """
-        Constructor for API instance.
+        Follow the RECORDNO text of the next record received.
+        """
+        try:
+            key = int(recordno)
+        except (TypeError, ValueError):
+            self.ordered = False
+            return
+        if self.last is not None and key <= self.last:
+            self.ordered = False
+        self.last = key
 
-        Keyword arguments:
-            senderid    The registered Web Services ID provided to you by
-                        Intacct.
-            senderpass  The registered Web Services Password.
-            userid      Your registered Intacct User ID.
-            userpass    This is your registered password.
-            companyid   Specifies the user's company.
+    def query(self):
         """
-        self.request = IntacctRequest(**kwargs)
+        Return the readByQuery element for the records after the last one
+        received, or None if that cannot be done.
+        """
+        if not self.ordered:
+            return None
+        if self.last is None:
+            return _read_by_query(*self.args, **self.kwargs)
+        condition = 'RECORDNO > %d' % self.last
+        query = self.kwargs.get('query')
+        return _read_by_query(*self.args, **dict(
+            self.kwargs,
+            query='(%s) AND %s' % (query, condition) if query
+            else condition))
+
+
+class _Tracked(object):
+    """
+    Iterates a streaming Response, passing each record to 'resume'.  A
+    transport or authentication error ends the iteration and is kept in
+    'error', for the query to be resumed.  The records of a columnar
+    response are passed on once it has been read.
+    """
+    def __init__(self, response, resume):
+        self.response = response
+        self.resume = resume
+        self.error = None
+
+    @property
+    def texts(self):
+        return self.response.texts
+
+    def __iter__(self):
+        try:
+            for record in self.response:
+                self.resume.see(record.findtext('RECORDNO'))
+                yield record
+        except (TransportError, AuthenticationError) as e:
+            self.error = e
+        texts = self.response.texts
+        if texts is not None:
+            for recordno in texts.get('RECORDNO') or [None] * texts.rows:
+                self.resume.see(recordno)
+
+
+class _Cursor(object):
+    """
+    The pooled session a query runs with, if there is a SessionManager,
+    as the results of a query may only be read with the session which ran
+    the query.  Like SessionManager.call, renew() replaces a session which
+    the gateway rejected after it had been used; the query must then be
+    run again with the new session.
+    """
+    def __init__(self, api):
+        self.api = api
+        self.lease = None
+        self.session = None
+        self.used = False
+        self._acquire()
+
+    def _acquire(self):
+        sessions = self.api.sessions
+        if sessions is not None:
+            lease = sessions.acquire(self.api)
+            self.session = lease.__enter__()
+            self.lease = lease
+            self.used = self.session.used
+
+    @property
+    def template(self):
+        return self.session.template if self.session is not None else None
+
+    def renew(self, error):
+        """
+        Drop the session rejected with the AuthenticationError 'error' and
+        take another one.  Returns False, keeping the session, if it had
+        not been used before or there is no SessionManager.
+        """
+        if self.session is None or not self.used:
+            return False
+        lease, self.lease, self.session = self.lease, None, None
+        lease.__exit__(type(error), error, None)
+        log.debug("Session rejected, running the query with another session")
+        self._acquire()
+        return True
+
+    def close(self, *exc_info):
+        lease, self.lease, self.session = self.lease, None, None
+        if lease is not None:
+            lease.__exit__(*(exc_info or (None, None, None)))
+
+
+class _Functions(object):
+    """
+    The gateway functions.  Each method creates a function element and
+    hands it to _call along with a handler which turns the function's
+    'operation/result' element into the return value; without a handler
+    the whole response is returned.
+    """
+    def _call(self, element, handler=None):
+        raise NotImplementedError
 
     def get_api_session(self):
         """
         Obtain a sessionid and endpoint to be used for subsequent
         requests.
         """
-        xml = self.request(ET.Element('getAPISession'))
-        sessionid = getattr(
-            xml.find('operation/result/data/api/sessionid'),
-            'text'
-        )
-        endpoint = getattr(
-            xml.find('operation/result/data/api/endpoint'),
-            'text'
-        )
+        return self._call(ET.Element('getAPISession'), self._set_session)
+
+    def _set_session(self, result):
+        sessionid = getattr(result.find('data/api/sessionid'), 'text')
+        endpoint = getattr(result.find('data/api/endpoint'), 'text')
         if sessionid and endpoint:
             self.request.set_session_id(sessionid, endpoint)
             log.debug(
@@ -84,11 +398,10 @@ class IntacctApi(object):
         type element are the fields and values to be updated.
         """
         assert args
-        assert len(args) <= 100
+        assert len(args) <= max_records
         update = ET.Element('update')
         objToEl(update, args)
-        self.request(update)
-        return True
+        return self._call(update, _success)
 
     def create(self, *args):
         """
@@ -98,11 +411,10 @@ class IntacctApi(object):
         the create method.
         """
         assert args
-        assert len(args) <= 100
+        assert len(args) <= max_records
         create = ET.Element('create')
         objToEl(create, args)
-        self.request(create)
-        return True
+        return self._call(create, _success)
 
     def delete(self, object, *args):
         """
@@ -110,12 +422,11 @@ class IntacctApi(object):
         the system limits the user to deleting 100 records in a single call.
         """
         assert args
-        assert len(args) <= 100
+        assert len(args) <= max_records
         delete = ET.Element('delete')
         ET.SubElement(delete, 'object').text = object
         ET.SubElement(delete, 'keys').text = ','.join(map(str, args))
-        self.request(delete)
-        return True
+        return self._call(delete, _success)
 
     def inspect(self, **kwargs):
         """
@@ -149,7 +460,7 @@ class IntacctApi(object):
             ET.SubElement(inspect, 'object').text = obj
         else:
             ET.SubElement(inspect, 'name').text = name
-        return self.request(inspect)
+        return self._call(inspect)
 
     def read(self, object, *args, **kwargs):
         """
@@ -157,6 +468,9 @@ class IntacctApi(object):
         keys.  The record key for custom objects is always the id field.
         For standard objects, the key is defined as the recordno in the
         object definition.
+
+        If 'compact' is set, a list of Rows (see intacct.rows) is returned
+        instead of the 'data' element.
         """
         fields = kwargs.get('fields') or ['*']
         assert isinstance(fields, list)
@@ -166,9 +480,7 @@ class IntacctApi(object):
         keys = ET.SubElement(read, 'keys')
         if args:
             keys.text = ','.join(map(str, args))
-        xml = self.request(read)
-        data = xml.find('operation/result/data')
-        return data
+        return self._call(read, _rows if kwargs.get('compact') else _data)
 
     def read_by_name(self, object, *args, **kwargs):
         """
@@ -176,6 +488,8 @@ class IntacctApi(object):
         names. The record name for custom objects is always the name
         field. For standard objects, the key is defined differently for
         each object type; see the object definition for details.
+
+        If 'compact' is set, a list of Rows is returned as for read.
         """
         fields = kwargs.get('fields') or ['*']
         assert isinstance(fields, list)
@@ -184,16 +498,488 @@ class IntacctApi(object):
         ET.SubElement(rbn, 'object').text = object
         ET.SubElement(rbn, 'fields').text = ','.join(map(str, fields))
         ET.SubElement(rbn, 'keys').text = ','.join(map(str, args))
-        xml = self.request(rbn)
-        data = xml.find('operation/result/data')
-        return data
+        return self._call(rbn, _rows if kwargs.get('compact') else _data)
 
-    def read_more(self, obj):
-        readmore = ET.Element('readMore')
-        ET.SubElement(readmore, 'object').text = obj
-        xml = self.request(readmore)
-        data = xml.find('operation/result/data')
-        return data
+    def read_more(self, obj, result_id=None):
+        return self._call(_read_more(obj, result_id), _data)
+
+
+class Batch(_Functions):
+    """
+    Collects calls to the gateway functions and posts them in as few
+    requests as possible, up to 'max_functions' per request.  Each call
+    returns a Future which is resolved, by controlid, from the result of
+    its function once the batch has been executed; calls which return the
+    whole response outside of a batch (inspect) resolve to their 'result'
+    element instead.  Use as a context manager to execute the batch on
+    exit.
+    """
+    def __init__(self, api):
+        self.api = api
+        self.request = api.request
+        self.pending = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.execute()
+        else:
+            for controlid, element, handler, future in self.pending:
+                future.cancel()
+            self.pending = []
+
+    def _call(self, element, handler=None):
+        future = Future()
+        controlid = str(len(self.pending))
+        self.pending.append((controlid, element, handler, future))
+        return future
+
+    def execute(self):
+        """
+        Post all pending calls and resolve their futures.  Failed functions
+        set an exception on their future rather than raising here.
+        """
+        pending, self.pending = self.pending, []
+        for i in range(0, len(pending), max_functions):
+            self._execute(pending[i:i + max_functions])
+        return [future for controlid, element, handler, future in pending]
+
+    def _execute(self, calls):
+        try:
+            functions = [
+                (controlid, element) for controlid, element, _, _ in calls
+            ]
+            xml = self.api._schedule(
+                lambda controlid: self.api._session(
+                    lambda template: self.request.call(
+                        functions, template, controlid)),
+                [element for controlid, element in functions])
+        except Exception as e:
+            self._invalidate(calls)
+            for controlid, element, handler, future in calls:
+                future.set_exception(e)
+            return
+        results = dict(
+            (result.findtext('controlid'), result)
+            for result in xml.findall('operation/result')
+        )
+        for controlid, element, handler, future in calls:
+            result = results.get(controlid)
+            if result is None:
+                future.set_exception(Exception(
+                    "No result for function '%s' (controlid: %s)" % (
+                        element.tag, controlid)))
+            elif result.findtext('status') != 'success':
+                future.set_exception(Exception(
+                    "Function '%s' failed: '%s'" % (
+                        element.tag, tostring(result))))
+            elif handler is None:
+                future.set_result(result)
+            else:
+                try:
+                    future.set_result(handler(result))
+                except Exception as e:
+                    future.set_exception(e)
+        self._invalidate(calls)
+
+    def _invalidate(self, calls):
+        cache = self.api.cache
+        if cache is not None:
+            for controlid, element, handler, future in calls:
+                cache.invalidate(written(element))
+
+
+class IntacctApi(_Functions):
+    def __init__(self, **kwargs):
+        """
+        Constructor for API instance.
+
+        Keyword arguments:
+            senderid    The registered Web Services ID provided to you by
+                        Intacct.
+            senderpass  The registered Web Services Password.
+            userid      Your registered Intacct User ID.
+            userpass    This is your registered password.
+            companyid   Specifies the user's company.
+            locationid  Optional. The entity to log in to.
+            url         Optional. The gateway URL used to log in.
+            max_workers Optional. The number of calls which may be in
+                        flight at once through submit, map and the bulk
+                        methods (default: 1).
+            cache       Optional. A ResultCache for the results of read,
+                        read_by_name and inspect.
+            metrics     Optional. A Metrics object recording timings and
+                        sizes of each call.
+            sessions    Optional. A SessionManager; calls then use pooled
+                        sessions instead of the one set by
+                        get_api_session.
+            scheduler   Optional. A Scheduler limiting the rate of calls
+                        and retrying failed ones.
+        """
+        self.request = IntacctRequest(**kwargs)
+        self.cache = kwargs.get('cache')
+        self.sessions = kwargs.get('sessions')
+        self.scheduler = kwargs.get('scheduler')
+        self.max_workers = kwargs.get('max_workers') or max_workers
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self):
+        """
+        The worker pool, created on first use.
+        """
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.max_workers)
+            return self._executor
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Run fn(*args, **kwargs), typically a method of this instance, on
+        the worker pool and return a Future:
+
+            future = api.submit(api.read, 'VENDOR', 1)
+        """
+        return self.executor.submit(fn, *args, **kwargs)
+
+    def map(self, fn, *iterables):
+        """
+        Like the builtin map, but calls are made on the worker pool with up
+        to 'max_workers' in flight.  Results are returned in order.
+        """
+        return self.executor.map(fn, *iterables)
+
+    def close(self):
+        """
+        Shut down the worker pool and close pooled connections.
+        """
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown()
+        self.request.connection.close()
+
+    def get_api_session(self):
+        """
+        Obtain a sessionid and endpoint to be used for subsequent
+        requests.  With a SessionManager, this only makes sure that a
+        pooled session is available.
+        """
+        if self.sessions is None:
+            return super(IntacctApi, self).get_api_session()
+        with self.sessions.acquire(self):
+            return True
+
+    def _session(self, fn):
+        """
+        Return fn(template) using a pooled session if there is a
+        SessionManager, otherwise the current session (template None).
+        """
+        if self.sessions is None:
+            return fn(None)
+        return self.sessions.call(self, fn)
+
+    def _schedule(self, fn, elements):
+        """
+        Return fn(controlid) through the Scheduler, if there is one.  A
+        retried write keeps its control id, so that with 'uniqueid' the
+        gateway will not run it twice.  Reads may safely run again and are
+        passed None, so that each request gets a new control id rather than
+        one the gateway would refuse as a duplicate.
+        """
+        reads = all(element.tag in _idempotent for element in elements)
+        controlid = None if reads else self.request.new_controlid()
+        if self.scheduler is None:
+            return fn(controlid)
+        idempotent = self.request.unique or reads
+        retried = None
+        metrics = self.request.metrics
+        if metrics is not None:
+            function = function_name([(None, e) for e in elements])
+            retried = lambda error: metrics.count(function, 'retries')
+        return self.scheduler.call(
+            self.request.key[1], lambda: fn(controlid), idempotent, retried)
+
+    @contextmanager
+    def _cursor(self):
+        """
+        Context manager holding on to a single session for a query; see
+        _Cursor.
+        """
+        cursor = _Cursor(self)
+        try:
+            yield cursor
+        except BaseException:
+            cursor.close(*sys.exc_info())
+            raise
+        cursor.close()
+
+    def _call(self, element, handler=None):
+        cache = self.cache
+        if cache is None:
+            return self._send(element, handler)
+        key, obj = cache_key(element)
+        if key is None:
+            try:
+                return self._send(element, handler)
+            finally:
+                cache.invalidate(written(element))
+        # Results are cached as returned by the handler.
+        key = (key, handler)
+        hit, value = cache.get(key)
+        metrics = self.request.metrics
+        if metrics is not None:
+            metrics.count(
+                element.tag, 'cache_hits' if hit else 'cache_misses')
+        if not hit:
+            generation = cache.generation(obj)
+            value = self._send(element, handler)
+            cache.set(key, obj, value, generation)
+        return value
+
+    def _send(self, element, handler):
+        xml = self._schedule(
+            lambda controlid: self._session(
+                lambda template: self.request(element, template, controlid)),
+            [element])
+        if handler is None:
+            return xml
+        return handler(xml.find('operation/result'))
+
+    def batch(self):
+        """
+        Return a Batch which collects function calls and posts them
+        together:
+
+            with api.batch() as b:
+                vendor = b.read('VENDOR', 1)
+                created = b.create(obj)
+            vendor.result()
+        """
+        return Batch(self)
+
+    def loader(self, wait=None):
+        """
+        Return a Loader which coalesces lookups of single records into
+        multi-key reads (see intacct.loader):
+
+            loader = api.loader()
+            vendors = [loader.load('VENDOR', key) for key in keys]
+            vendors[0].result()
+        """
+        return Loader(self, wait)
+
+    def _bulk(self, build, chunks, report=None):
+        """
+        Post the element created by 'build' from the items of each chunk of
+        (record, item) pairs on the worker pool.  Elements for further
+        chunks are created while up to 'max_workers' calls are on the
+        wire.
+        """
+        report = report or BulkReport()
+        pending = deque()
+        for chunk in chunks:
+            records = [record for record, item in chunk]
+            try:
+                element = build([item for record, item in chunk])
+            except Exception as e:
+                report.failed.extend((record, e) for record in records)
+                continue
+            if len(pending) >= self.max_workers:
+                report.add(*pending.popleft())
+            pending.append((records, self.submit(self._call, element)))
+        while pending:
+            report.add(*pending.popleft())
+        return report
+
+    def _bulk_write(self, tag, records, validate):
+        """
+        Post 'records' in 'tag' ('create' or 'update') elements.  Unless
+        'validate' is False, each record is first checked against the
+        ObjectCache, and the records which fail are reported as failed
+        without being sent, so that they do not fail the call of the
+        records they would have been sent with.
+        """
+        report = BulkReport()
+        found = {}
+
+        def elements():
+            for record in records:
+                try:
+                    el = _to_element(record)
+                    if validate:
+                        validator = getattr(record, '_validator', None)
+                        if validator is None:
+                            if el.tag not in found:
+                                found[el.tag] = validators.get(el.tag)
+                            validator = found[el.tag]
+                        if validator is not None:
+                            validator.check(el, tag)
+                except Exception as e:
+                    report.failed.append((record, e))
+                    continue
+                yield record, el
+        return self._bulk(
+            _element(tag), chunked(elements(), max_records), report)
+
+    def bulk_create(self, records, validate=True):
+        """
+        Create any number of records, 'max_records' per call.  Returns a
+        BulkReport; a failed call marks each of its records as failed.
+        Records which fail validation (see intacct.validation) are not
+        sent unless 'validate' is False.
+        """
+        return self._bulk_write('create', records, validate)
+
+    def bulk_update(self, records, validate=True):
+        """
+        Update any number of records, 'max_records' per call.  Returns a
+        BulkReport; a failed call marks each of its records as failed.
+        Records which fail validation (see intacct.validation) are not
+        sent unless 'validate' is False.
+        """
+        return self._bulk_write('update', records, validate)
+
+    def bulk_delete(self, object, keys):
+        """
+        Delete any number of records of type 'object' given their keys,
+        'max_records' per call.  Returns a BulkReport of keys.
+        """
+        def build(keys):
+            delete = ET.Element('delete')
+            ET.SubElement(delete, 'object').text = object
+            ET.SubElement(delete, 'keys').text = ','.join(map(str, keys))
+            return delete
+        return self._bulk(
+            build, chunked(((key, key) for key in keys), max_records))
+
+    def _resume(self, resume, cursor, error, retried):
+        """
+        Return the readByQuery element continuing a query after 'error', or
+        raise 'error' if the query cannot be resumed.  A readMore is not
+        repeated once sent, as the cursor may have moved on; instead the
+        query is run again for the records after the last one received.
+        'retried' is True if the Scheduler has already retried the failed
+        request, as it does for a readByQuery.  A session rejected by the
+        gateway is replaced (see _Cursor) and the query resumed at once.
+        """
+        if resume is None:
+            raise error
+        if isinstance(error, AuthenticationError):
+            element = resume.query()
+            if element is None or not cursor.renew(error):
+                raise error
+            return element
+        scheduler = self.scheduler
+        if scheduler is None or retried or \
+                resume.resumes >= scheduler.retries or \
+                not scheduler.retryable(error):
+            raise error
+        element = resume.query()
+        if element is None:
+            raise error
+        delay = scheduler.delay(resume.resumes, error)
+        log.debug("Resuming query in %.2fs after: %s", delay, error)
+        resume.resumes += 1
+        time.sleep(delay)
+        return element
+
+    def _query_pages(self, *args, **kwargs):
+        """
+        Generator which runs a readByQuery and yields each page of results
+        (the 'data' element) as it is received, following up with readMore
+        until no records remain.  With a Scheduler, a failed page is
+        retried; see _Resume.  With a SessionManager, a query whose session
+        is rejected is resumed with another session.
+        """
+        obj = args[0]
+        resume = _Resume(args, kwargs) \
+            if self.scheduler or self.sessions else None
+        element = _read_by_query(*args, **kwargs)
+        with self._cursor() as cursor:
+            while True:
+                try:
+                    xml = self._schedule(
+                        lambda controlid: self.request(
+                            element, cursor.template, controlid), [element])
+                except Exception as e:
+                    element = self._resume(
+                        resume, cursor, e, element.tag != 'readMore')
+                    continue
+                cursor.used = True
+                data = xml.find('operation/result/data')
+                if data is None:
+                    break
+                if resume is not None:
+                    for record in data:
+                        resume.see(record.findtext('RECORDNO'))
+                yield data
+                if int(data.attrib.get('numremaining', 0)) <= 0:
+                    break
+                element = _read_more(obj, data.attrib.get('resultId'))
+
+    def _query_responses(self, *args, **kwargs):
+        """
+        Generator which runs a readByQuery and yields a streaming Response
+        for each page, following up with readMore until no records remain.
+        Each response must be consumed before the next one is requested.
+        With a Scheduler, a page is retried if it fails before its records
+        start arriving, and a query failing part way through is resumed
+        (see _Resume); the records of the failed page are then followed by
+        those of the resumed query.  With a SessionManager, a query whose
+        session is rejected is resumed with another session.
+
+        When 'columnar' is set, the responses collect the field texts of
+        their records in 'texts' instead of yielding record elements.
+        """
+        obj = args[0]
+        columnar = kwargs.pop('columnar', False)
+        resume = _Resume(args, kwargs) \
+            if self.scheduler or self.sessions else None
+        with self._cursor() as cursor:
+            element = _read_by_query(*args, **kwargs)
+            while True:
+                try:
+                    response = self._schedule(
+                        lambda controlid: self.request.stream(
+                            element, cursor.template, controlid,
+                            columnar), [element])
+                except Exception as e:
+                    element = self._resume(
+                        resume, cursor, e, element.tag != 'readMore')
+                    continue
+                page = response if resume is None else \
+                    _Tracked(response, resume)
+                try:
+                    yield page
+                finally:
+                    # Closes the connection if it was not read.
+                    response.discard()
+                if page is not response and page.error is not None:
+                    element = self._resume(
+                        resume, cursor, page.error, False)
+                    continue
+                cursor.used = True
+                data = response.data
+                if data is None or \
+                        int(data.attrib.get('numremaining', 0)) <= 0:
+                    break
+                element = _read_more(obj, data.attrib.get('resultId'))
+
+    def _query_texts(self, *args, **kwargs):
+        """
+        Generator which runs a readByQuery and yields the columns.Texts of
+        each page, parsed straight from the response without building
+        record elements.
+        """
+        for response in self._query_responses(
+                *args, columnar=True, **kwargs):
+            for record in response:
+                pass
+            yield response.texts
 
     def read_by_query(self, *args, **kwargs):
         """
@@ -206,24 +992,166 @@ class IntacctApi(object):
         query          - The query string to execute.  Use SQL operators
         fields         - A comma separated list of fields to return
         pagesize       - The number of records to return.
+        return_format  - 'xml' (default), 'json' or 'csv'.  The records
+                         are parsed into the same elements whichever
+                         format is used.
+        as_columns     - Return typed Columns (see intacct.columns)
+                         instead of the 'data' element.
+        compact        - Return a list of Rows (see intacct.rows)
+                         instead of the 'data' element.  Each record is
+                         converted as soon as it has been parsed.
         """
-        assert args
-        obj = args[0]
-        pagesize = kwargs.get('pagesize') or page_size
-        pagesize = pagesize <= max_page_size and pagesize or page_size
-        readbyquery = ET.Element('readByQuery')
-        ET.SubElement(readbyquery, 'object').text = obj
-        ET.SubElement(readbyquery, 'fields').text = kwargs.get('fields') or '*'
-        ET.SubElement(readbyquery, 'query').text = kwargs.get('query') or ''
-        ET.SubElement(readbyquery, 'returnFormat').text = 'xml'
-        ET.SubElement(readbyquery, 'pagesize').text = str(pagesize)
-        xml = self.request(readbyquery)
-        data = xml.find('operation/result/data')
-        remaining = 0
-        if data:
-            remaining = int(data.attrib['numremaining'])
-        while remaining > 0:
-            newdata = self.read_more(obj)
-            data.extend(newdata)
-            remaining = int(newdata.attrib['numremaining'])
+        if kwargs.pop('as_columns', False):
+            columns = Columns(schema(args[0]))
+            for texts in self._query_texts(*args, **kwargs):
+                columns.extend_texts(texts)
+            return columns
+        if kwargs.pop('compact', False):
+            rows = []
+            for response in self._query_responses(*args, **kwargs):
+                rows.extend(compact(response))
+            return rows
+        data = None
+        for page in self._query_pages(*args, **kwargs):
+            if data is None:
+                data = page
+            else:
+                data.extend(page)
         return data
+
+    def iter_by_query(self, *args, **kwargs):
+        """
+        Read records using a query, yielding each record as soon as it has
+        been parsed from the response.  Records are discarded once consumed,
+        so memory use does not grow with the size of the result set.
+        Arguments are the same as for read_by_query.
+
+        Keyword arguments:
+        pages          - Yield whole pages ('data' elements) instead of
+                         individual records.
+        as_columns     - Yield typed Columns for each page instead of
+                         individual records.
+        compact        - Yield Rows (see intacct.rows) instead of record
+                         elements.
+        """
+        if kwargs.pop('pages', False):
+            for page in self._query_pages(*args, **kwargs):
+                yield page
+            return
+        if kwargs.pop('as_columns', False):
+            fields = schema(args[0])
+            for texts in self._query_texts(*args, **kwargs):
+                columns = Columns(fields)
+                columns.extend_texts(texts)
+                yield columns
+            return
+        convert = compact if kwargs.pop('compact', False) else iter
+        for response in self._query_responses(*args, **kwargs):
+            for record in convert(response):
+                yield record
+
+    def _count(self, obj, query, key):
+        """
+        Return the number of records matching 'query' and the 'key' of one
+        of them.
+        """
+        element = _read_by_query(obj, query=query, fields=key, pagesize=1)
+        data = self._send(element, None).find('operation/result/data')
+        if data is None or not len(data):
+            return 0, None
+        return int(data.attrib.get('totalcount', len(data))), \
+            data[0].findtext(key)
+
+    def partition_bounds(self, obj, query=None, key='RECORDNO',
+                         partitions=None, probes=None):
+        """
+        Probe the integer field 'key' among the records matching 'query'
+        and return the bounds splitting them into 'partitions' ranges of
+        about the same number of records.  Each bound is placed by
+        bisecting on the number of records below it, with at most
+        'probes' counts (default: 'partition_probes'), and the bounds are
+        searched for concurrently.  Returns no bounds (one partition) if
+        the counts do not narrow down, e.g. when the gateway does not
+        apply the query.
+        """
+        partitions = partitions or export_partitions
+        probes = probes or partition_probes
+        total, sample = self._count(obj, query, key)
+        if total < 2 or partitions < 2:
+            return []
+        sample = int(sample)
+
+        def below(x):
+            condition = '%s < %d' % (key, x)
+            q = '(%s) AND %s' % (query, condition) if query else condition
+            return self._count(obj, q, key)[0]
+
+        # The sampled record itself is never below its own key.
+        if below(sample) >= total:
+            log.warning("Counts of %s by %s do not narrow down; "
+                        "exporting a single partition", obj, key)
+            return []
+        targets = sorted(set(
+            total * i // partitions for i in range(1, partitions)) - {0})
+        tolerance = total // (partitions * 8)
+        grow_pool(self.request.connection, len(targets))
+        executor = ThreadPoolExecutor(len(targets))
+        try:
+            # Steps in proportion to the key keep these searches short;
+            # bisection narrows the wider range in a few more counts.
+            step = abs(sample) or 1
+            first = executor.submit(
+                _bracket, lambda x: below(x) == 0, sample - step, -step)
+            last = executor.submit(
+                _bracket, lambda x: below(x) >= total, sample + step, step)
+            lo, hi = first.result(), last.result()
+            if lo is None or hi is None:
+                log.warning("Range of %s by %s not found; "
+                            "exporting a single partition", obj, key)
+                return []
+            bounds = executor.map(
+                lambda target: _bisect(
+                    below, lo, hi, target, tolerance, probes),
+                targets)
+            return sorted(set(b for b in bounds if lo < b <= hi))
+        finally:
+            executor.shutdown()
+
+    def export(self, obj, **kwargs):
+        """
+        Read every record matching a query by splitting it into disjoint
+        ranges of a key field which are read concurrently, each with its
+        own cursor.  Records are yielded in no particular order as they
+        arrive; each record is yielded exactly once.
+
+        Arguments:
+        obj            - The name of object upon which to run the query
+
+        Keyword arguments:
+        query          - The query string to execute.
+        fields         - A comma separated list of fields to return
+        pagesize       - The number of records to return per page.
+        partition_by   - The field to partition on (default: RECORDNO).
+        partitions     - The number of partitions read at once.
+        bounds         - The values of 'partition_by' at which partitions
+                         start, e.g. dates.  By default the (integer)
+                         field is probed for bounds splitting the records
+                         evenly; see partition_bounds.
+        """
+        key = kwargs.pop('partition_by', 'RECORDNO')
+        partitions = kwargs.pop('partitions', None) or export_partitions
+        bounds = kwargs.pop('bounds', None)
+        query = kwargs.pop('query', None)
+        if bounds is None:
+            bounds = self.partition_bounds(obj, query, key, partitions)
+        queries = _partition_queries(query, key, bounds)
+        # A connection for each partition, so that none are discarded.
+        grow_pool(self.request.connection, len(queries))
+        executor = ThreadPoolExecutor(len(queries))
+        try:
+            for q, record in fan_in(executor, [
+                    (q, partial(self.iter_by_query, obj, query=q, **kwargs))
+                    for q in queries]):
+                yield record
+        finally:
+            executor.shutdown(wait=False)
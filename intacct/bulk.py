@@ -0,0 +1,52 @@
+"""
+Helpers for bulk writes which exceed the per-call record limit.
+"""
+
+from itertools import islice
+
+
+def chunked(iterable, size):
+    """
+    Yield lists of up to 'size' items from 'iterable'.
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            break
+        yield chunk
+
+
+class BulkReport(object):
+    """
+    Aggregated outcome of a bulk write.  'succeeded' holds (record, result)
+    pairs, where 'result' is the element the gateway returned for the record
+    (None if it returned nothing for it), and 'failed' holds
+    (record, exception) pairs.  For deletes the records are the keys.
+    """
+    def __init__(self):
+        self.succeeded = []
+        self.failed = []
+
+    def __repr__(self):
+        return '<BulkReport succeeded=%d failed=%d>' % (
+            len(self.succeeded), len(self.failed))
+
+    @property
+    def ok(self):
+        return not self.failed
+
+    def add(self, records, future):
+        """
+        Record the outcome of the call in 'future' for 'records'.
+        """
+        try:
+            xml = future.result()
+        except Exception as e:
+            self.failed.extend((record, e) for record in records)
+            return
+        data = xml.find('operation/result/data')
+        results = list(data) if data is not None else []
+        if len(results) != len(records):
+            results = [None] * len(records)
+        self.succeeded.extend(zip(records, results))
@@ -0,0 +1,194 @@
+"""
+Conversion of query results to typed columns using the field types stored
+in the ObjectCache.
+"""
+
+from array import array
+from .formats import text
+
+try:
+    array('q')
+    INT = 'q'
+except ValueError:
+    INT = 'l'
+
+NAN = float('nan')
+
+# Field types (externalDataName) by column conversion
+FLOAT_TYPES = ('currency', 'decimal', 'number', 'percent')
+INT_TYPES = ('integer',)
+BOOL_TYPES = ('boolean',)
+# Field types assumed when the object is not in the ObjectCache
+DEFAULT_TYPES = {'RECORDNO': 'integer'}
+
+
+def _floats(texts):
+    return array('d', [float(t) if t else NAN for t in texts])
+
+
+def _ints(texts):
+    if all(texts):
+        return array(INT, [int(t) for t in texts])
+    return [int(t) if t else None for t in texts]
+
+
+def _bools(texts):
+    return [t == 'true' if t else None for t in texts]
+
+
+def _strings(texts):
+    return list(texts)
+
+
+def converter(field):
+    """
+    Return the function converting a list of texts to a column for a
+    field's ObjectCache entry.
+    """
+    datatype = field.get('externalDataName')
+    if datatype in FLOAT_TYPES:
+        return _floats
+    if datatype in INT_TYPES:
+        return _ints
+    if datatype in BOOL_TYPES:
+        return _bools
+    return _strings
+
+
+class Texts(object):
+    """
+    The texts of the fields of a page of records by column, collected as
+    the records are parsed: start() and end() mark each record, add()
+    each field.  Of a field repeated within a record, only the first value
+    is kept, and the fields of a record which is not ended are dropped.
+    """
+    def __init__(self):
+        self.texts = {}
+        self.started = 0
+        self.rows = 0
+
+    def start(self):
+        self.started += 1
+
+    def add(self, name, value):
+        values = self.texts.get(name)
+        if values is None:
+            values = self.texts[name] = [None] * (self.started - 1)
+        else:
+            missing = self.started - 1 - len(values)
+            if missing < 0:
+                return
+            if missing:
+                values.extend([None] * missing)
+        values.append(value)
+
+    def end(self):
+        self.rows = self.started
+
+    def record(self, tag, items):
+        """
+        Add a record of decoded (field, value) pairs; see formats.record.
+        """
+        self.start()
+        for name, value in items:
+            if isinstance(value, dict):
+                for sub, v in value.items():
+                    self.add(name + '.' + sub, text(v))
+            else:
+                self.add(name, text(value))
+        self.end()
+
+    def columns(self):
+        """
+        Return a dict of the lists of texts by field, one text per record.
+        """
+        rows = self.rows
+        columns = {}
+        for name, values in self.texts.items():
+            if len(values) < rows:
+                values.extend([None] * (rows - len(values)))
+            elif len(values) > rows:
+                del values[rows:]
+            columns[name] = values
+        return columns
+
+    def get(self, name):
+        return self.columns().get(name)
+
+
+def schema(obj):
+    """
+    Return the ObjectCache entry for 'obj', or None.
+    """
+    from .objcache import shared_cache
+    return shared_cache().get(obj)
+
+
+class Columns(dict):
+    """
+    Query results as a dict of columns by field name.  Numeric fields are
+    stored as array('d') (NaN for missing values) or integer arrays (or
+    lists holding None when values are missing); booleans and everything
+    else as lists.  Fields of nested objects are named 'OBJECT.FIELD'; of
+    a field repeated within a record, only the first value is kept.  Rows
+    are appended a page at a time with extend(), or extend_texts() for
+    texts collected while parsing.
+
+    Arguments:
+        fields    The ObjectCache entry describing the object's fields.
+    """
+    def __init__(self, fields=None):
+        super(Columns, self).__init__()
+        self.fields = fields or {}
+        self.converters = {}
+        self.rows = 0
+
+    def _converter(self, name):
+        conv = self.converters.get(name)
+        if conv is None:
+            field = self.fields
+            for part in name.split('.'):
+                field = field.get(part) or {}
+            if 'externalDataName' not in field and name in DEFAULT_TYPES:
+                field = {'externalDataName': DEFAULT_TYPES[name]}
+            conv = self.converters[name] = converter(field)
+        return conv
+
+    def extend(self, records):
+        """
+        Convert a page of record elements and append them to the columns.
+        """
+        texts = Texts()
+        for record in records:
+            texts.start()
+            for child in record:
+                if len(child):
+                    for sub in child:
+                        texts.add(child.tag + '.' + sub.tag, sub.text)
+                else:
+                    texts.add(child.tag, child.text)
+            texts.end()
+        self.extend_texts(texts)
+
+    def extend_texts(self, texts):
+        """
+        Convert a page of Texts and append them to the columns.
+        """
+        n = texts.rows
+        columns = texts.columns()
+        for name, values in columns.items():
+            self._append(name, self._converter(name)(values))
+        for name in list(self):
+            if name not in columns:
+                self._append(name, self._converter(name)([None] * n))
+        self.rows += n
+        assert all(len(column) == self.rows for column in self.values())
+
+    def _append(self, name, column):
+        if name not in self:
+            self[name] = self._converter(name)([None] * self.rows)
+        existing = self[name]
+        if type(existing) is type(column):
+            existing.extend(column)
+        else:
+            self[name] = list(existing) + list(column)
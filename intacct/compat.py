@@ -0,0 +1,17 @@
+"""
+intacct.compat
+~~~~~~~~~~~~~~
+
+Names which differ between Python 2 and 3.
+
+"""
+
+import os
+
+try:
+    string_types = basestring
+except NameError:
+    string_types = str
+
+# Replaces the destination if it exists (os.rename on Python 2)
+replace = getattr(os, 'replace', os.rename)
@@ -8,6 +8,20 @@ api_url = 'https://api.intacct.com/ia/xml/xmlgw.phtml'
 page_size = 1000
 # Maximum page size
 max_page_size = 100000
+# Maximum number of records per create, update or delete
+max_records = 100
+# Maximum number of functions posted in a single request
+max_functions = 100
+# Default number of concurrent requests (and pooled connections) per API
+max_workers = 1
+# Default number of partitions read at once by IntacctApi.export
+export_partitions = 4
+# Maximum number of counts made to place each partition bound of an export
+partition_probes = 16
+# Default number of concurrent requests for the asyncio client
+max_concurrency = 100
+# Number of bytes read from the response at a time while parsing
+chunk_size = 64 * 1024
 # A list of objects that will be 'inspected' and
 # whose meta data will be stored.  This cache is used
 # to implement helper classes for creating these types
@@ -15,3 +29,19 @@ max_page_size = 100000
 cache_objects = ['User', 'User Role']
 # Name of cache file.
 cache_file = '.intacct.cache'
+# Name of the directory holding persisted sessions.
+session_dir = '.intacct.sessions'
+# Seconds after which an unused session is assumed to have expired.
+session_lifetime = 30 * 60
+# Default number of sessions per set of credentials in a SessionManager.
+session_pool_size = 8
+# Number of times a Scheduler retries a failed call.
+max_retries = 3
+# Seconds before the first retry; the delay doubles with each retry.
+retry_backoff = 0.5
+# Upper bound in seconds for the delay between retries.
+max_backoff = 30
+# Seconds before the last modification time which a sync reads again.
+sync_overlap = 60
+# Seconds between the reconciliations of deleted records by a sync.
+reconcile_interval = 24 * 60 * 60
@@ -0,0 +1,79 @@
+"""
+Exceptions raised by the Intacct API.
+"""
+
+
+class IntacctError(Exception):
+    """
+    A request failed.  'status_code' is the HTTP status and 'response' the
+    parsed response, when there is one.
+    """
+    def __init__(self, message, status_code=None, response=None):
+        super(IntacctError, self).__init__(message)
+        self.status_code = status_code
+        self.response = response
+
+    @property
+    def errors(self):
+        """
+        The gateway's error messages as a list of dicts with the keys
+        'errorno', 'description', 'description2' and 'correction'.
+        """
+        if self.response is None:
+            return []
+        return [
+            dict((field.tag, field.text) for field in error)
+            for error in self.response.iter('error')
+        ]
+
+
+class AuthenticationError(IntacctError):
+    """
+    The gateway rejected the login credentials or the session.
+    """
+
+
+class TransportError(IntacctError):
+    """
+    The request failed on its way to or from the gateway, or the gateway
+    was unavailable.  'sent' is False when the request cannot have reached
+    the gateway, so that retrying it is always safe.
+    """
+    def __init__(self, message, status_code=None, response=None, sent=True):
+        super(TransportError, self).__init__(message, status_code, response)
+        self.sent = sent
+
+
+class ThrottledError(TransportError):
+    """
+    The gateway turned the request away because of its rate limits.
+    'retry_after' is the number of seconds to wait it asked for, if any.
+    """
+    def __init__(self, message, status_code=None, response=None,
+                 retry_after=None):
+        super(ThrottledError, self).__init__(
+            message, status_code, response, sent=False)
+        try:
+            self.retry_after = float(retry_after)
+        except (TypeError, ValueError):
+            self.retry_after = None
+
+
+class ValidationError(IntacctError):
+    """
+    A record failed the client side checks against the ObjectCache, and
+    was not sent.  'problems' is a list of (field, message) pairs.
+    """
+    def __init__(self, object, problems):
+        super(ValidationError, self).__init__('Invalid %s: %s' % (
+            object, '; '.join('%s %s' % p for p in problems)))
+        self.object = object
+        self.problems = problems
+
+    @property
+    def errors(self):
+        return [
+            {'errorno': None, 'description': '%s %s' % problem,
+             'description2': None, 'correction': None}
+            for problem in self.problems
+        ]
@@ -0,0 +1,156 @@
+"""
+Streaming decoders for query results returned as JSON or CSV.  The
+gateway puts the formatted records in the text of the 'data' element;
+the decoders turn them into record elements like those of the XML
+format, so that callers see the same records whichever format is used.
+"""
+
+try:
+    import xml.etree.cElementTree as ET
+except ImportError:
+    import xml.etree.ElementTree as ET
+
+import csv
+import json
+from collections import OrderedDict
+from .compat import string_types
+
+# Values of returnFormat
+formats = ('xml', 'json', 'csv')
+
+
+def text(value):
+    """
+    Return the element text of a decoded value, or None if it is empty.
+    """
+    if value is None or value == '':
+        return None
+    if isinstance(value, string_types):
+        return value
+    return json.dumps(value) if isinstance(value, bool) else str(value)
+
+
+def record(tag, items):
+    """
+    Return a record element for (field, value) pairs.  Fields named
+    'OBJECT.FIELD', or holding a dict, become fields of a nested object.
+    Empty values become empty elements, as in the XML format.
+    """
+    el = ET.Element(tag)
+    nested = {}
+    for name, value in items:
+        if isinstance(value, dict):
+            el.append(record(name, value.items()))
+            continue
+        parent = el
+        if '.' in name:
+            outer, name = name.split('.', 1)
+            parent = nested.get(outer)
+            if parent is None:
+                parent = nested[outer] = ET.SubElement(el, outer)
+        ET.SubElement(parent, name).text = text(value)
+    return el
+
+
+class JsonRecords(object):
+    """
+    Decode a JSON array of objects, fed in pieces, into record elements,
+    or whatever make(tag, items) returns for the (field, value) pairs of
+    each object.
+    """
+    def __init__(self, tag, make=record):
+        self.tag = tag
+        self.make = make
+        self.buffer = ''
+        self.decoder = json.JSONDecoder(object_pairs_hook=OrderedDict)
+
+    def feed(self, text):
+        """
+        Return the records completed by 'text'.
+        """
+        self.buffer += text
+        if '}' not in text:
+            return []
+        records = []
+        buf = self.buffer
+        pos = 0
+        while True:
+            while pos < len(buf) and buf[pos] in ' \t\r\n[,]':
+                pos += 1
+            if pos == len(buf):
+                break
+            try:
+                obj, end = self.decoder.raw_decode(buf, pos)
+            except ValueError:
+                # Incomplete; wait for the rest of the object.
+                break
+            records.append(self.make(self.tag, obj.items()))
+            pos = end
+        self.buffer = buf[pos:]
+        return records
+
+    def close(self):
+        if self.buffer.strip(' \t\r\n[,]'):
+            raise ValueError("Invalid JSON records: %r" % self.buffer[:100])
+        return []
+
+
+class CsvRecords(object):
+    """
+    Decode CSV, with a header line naming the fields, fed in pieces, into
+    record elements, or whatever make(tag, items) returns for the (field,
+    value) pairs of each row.
+    """
+    def __init__(self, tag, make=record):
+        self.tag = tag
+        self.make = make
+        self.buffer = ''
+        self.fields = None
+
+    def _rows(self, final=False):
+        lines = self.buffer.splitlines(True)
+        rows = []
+        row = ''
+        for line in lines:
+            row += line
+            # A quoted field may span lines.
+            if row.count('"') % 2 == 0 and (final or row.endswith('\n')):
+                if row.strip():
+                    rows.append(row)
+                row = ''
+        self.buffer = row
+        return rows
+
+    def _records(self, rows):
+        records = []
+        for values in csv.reader(rows):
+            if self.fields is None:
+                self.fields = values
+            else:
+                records.append(
+                    self.make(self.tag, zip(self.fields, values)))
+        return records
+
+    def feed(self, text):
+        """
+        Return the records completed by 'text'.
+        """
+        self.buffer += text
+        if '\n' not in text:
+            return []
+        return self._records(self._rows())
+
+    def close(self):
+        records = self._records(self._rows(final=True))
+        if self.buffer.strip():
+            raise ValueError("Invalid CSV records: %r" % self.buffer[:100])
+        return records
+
+
+def decoder(start, tag, make=record):
+    """
+    Return the decoder for records whose text starts with 'start'.
+    """
+    if start.lstrip()[:1] in ('[', '{'):
+        return JsonRecords(tag, make)
+    return CsvRecords(tag, make)
@@ -0,0 +1,210 @@
+"""
+intacct.loader
+~~~~~~~~~~~~~~
+
+Coalescing of single record lookups into multi-key reads.
+
+"""
+
+import logging
+import threading
+from concurrent.futures import Future
+log = logging.getLogger(__name__)
+from .bulk import chunked
+from .columns import schema
+from .compat import string_types
+from .default import max_records
+
+# The names read by readByName, for objects where it is not the first of
+# '<OBJECT>ID' and 'NAME' found in the ObjectCache
+name_fields = {'USERINFO': 'LOGINID'}
+
+
+class _LoadFuture(Future):
+    """
+    A Future which dispatches the pending lookups of its Loader when its
+    result is asked for, so that no explicit flush is needed.  Loaders
+    with a 'wait' leave that to their timer, to collect lookups made by
+    other threads meanwhile.
+    """
+    def __init__(self, loader):
+        super(_LoadFuture, self).__init__()
+        self.loader = loader
+
+    def result(self, timeout=None):
+        if not self.done() and self.loader.wait is None:
+            self.loader.dispatch()
+        return super(_LoadFuture, self).result(timeout)
+
+    def exception(self, timeout=None):
+        if not self.done() and self.loader.wait is None:
+            self.loader.dispatch()
+        return super(_LoadFuture, self).exception(timeout)
+
+
+def name_field(object):
+    """
+    Return the field holding the names read by readByName for 'object',
+    or None if it is not known.
+    """
+    object = object.upper()
+    if object in name_fields:
+        return name_fields[object]
+    fields = schema(object) or {}
+    for name in (object + 'ID', 'NAME'):
+        if name in fields:
+            return name
+    return None
+
+
+def _match(records, keys, key_field):
+    """
+    Return a dict of the records by their 'key_field', for those holding
+    one of 'keys'.  Raises LookupError if a record lacks the field.
+    """
+    keys = set(keys)
+    found = {}
+    for record in records:
+        key = record.findtext(key_field)
+        if key is None:
+            raise LookupError(
+                "Record %s has no key field '%s'" % (record.tag, key_field))
+        if key in keys:
+            found.setdefault(key, record)
+    return found
+
+
+class Loader(object):
+    """
+    Collects lookups of single records and reads them with as few calls
+    as possible: one read (or readByName) per object and field list for
+    up to 'max_records' keys, posted together in a Batch.  Lookups of a
+    key which is already pending or being read share its Future.
+
+        loader = api.loader()
+        vendors = [loader.load('VENDOR', key) for key in keys]
+        names = [v.result().findtext('NAME') for v in vendors]
+
+    Records are matched to keys on RECORDNO for read and, for readByName,
+    on the field given as 'key_field' or found by name_field(); the key
+    field is added to 'fields' if they leave it out.
+
+    Pending lookups are read when the result of any of them is asked for,
+    when dispatch() is called (or the loader is used as a context manager
+    and the block exits), or, if 'wait' is given, at most 'wait' seconds
+    after the first of them (or as soon as a read is full).  Each Future
+    resolves to the record element, or None if the gateway did not return
+    the record.
+    """
+    def __init__(self, api, wait=None):
+        self.api = api
+        self.wait = wait
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.loading = {}
+        self.timer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.dispatch()
+
+    def load(self, object, key, fields=None, by_name=False, key_field=None):
+        """
+        Return a Future for the record of 'object' with 'key' (its name if
+        'by_name' is set), reading 'fields' (default: all), a list or a
+        comma separated string as for read_by_query.  Raises
+        ValueError if the field holding the names of 'object' is not known
+        and no 'key_field' is given.
+        """
+        function = 'readByName' if by_name else 'read'
+        if key_field is None:
+            key_field = name_field(object) if by_name else 'RECORDNO'
+            if key_field is None:
+                raise ValueError(
+                    "The name field of %s is not known; pass key_field"
+                    % object)
+        if isinstance(fields, string_types):
+            fields = [field.strip() for field in fields.split(',')]
+        fields = list(fields or ['*'])
+        if '*' not in fields and key_field not in fields:
+            fields.append(key_field)
+        group = (function, object, tuple(fields), key_field)
+        key = str(key)
+        with self.lock:
+            future = self.loading.get((group, key))
+            if future is not None:
+                return future
+            keys = self.pending.setdefault(group, {})
+            future = keys.get(key)
+            if future is not None:
+                return future
+            future = keys[key] = _LoadFuture(self)
+            full = self.wait is not None and len(keys) >= max_records
+            if self.wait is not None and self.timer is None and not full:
+                self.timer = threading.Timer(self.wait, self.dispatch)
+                self.timer.daemon = True
+                self.timer.start()
+        if full:
+            # No need to wait for more keys once a call is full.
+            self.dispatch()
+        return future
+
+    def load_many(self, object, keys, fields=None, by_name=False,
+                  key_field=None):
+        """
+        Return a list of Futures for the records of 'object' with 'keys'.
+        """
+        return [self.load(object, key, fields, by_name, key_field)
+                for key in keys]
+
+    def dispatch(self):
+        """
+        Read all pending lookups.
+        """
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            for group, keys in pending.items():
+                for key, future in keys.items():
+                    self.loading[(group, key)] = future
+        if not pending:
+            return
+        calls = []
+        try:
+            with self.api.batch() as batch:
+                for group, keys in pending.items():
+                    function, object, fields, key_field = group
+                    read = batch.read_by_name if function == 'readByName' \
+                        else batch.read
+                    for chunk in chunked(keys, max_records):
+                        calls.append((group, chunk, read(
+                            object, *chunk, fields=list(fields))))
+        except Exception as e:
+            calls = [(group, list(keys), e) for group, keys in
+                     pending.items()]
+        for group, chunk, call in calls:
+            self._resolve(group, chunk, pending[group], call)
+        log.debug("Loaded %d keys in %d calls",
+                  sum(len(keys) for keys in pending.values()), len(calls))
+
+    def _resolve(self, group, chunk, futures, call):
+        error = call if isinstance(call, Exception) else call.exception()
+        if error is None:
+            data = call.result()
+            try:
+                records = _match(
+                    [] if data is None else data, chunk, group[3])
+            except LookupError as e:
+                error = e
+        with self.lock:
+            for key in chunk:
+                del self.loading[(group, key)]
+        for key in chunk:
+            if error is not None:
+                futures[key].set_exception(error)
+            else:
+                futures[key].set_result(records.get(key))
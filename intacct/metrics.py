@@ -0,0 +1,139 @@
+"""
+intacct.metrics
+~~~~~~~~~~~~~~~
+
+Per-call instrumentation and an in-process registry of metrics by gateway
+function.
+
+"""
+
+import threading
+import time
+
+# High resolution clock for timings
+timer = getattr(time, 'perf_counter', time.time)
+
+# Counters kept for each function
+fields = (
+    'calls', 'errors', 'serialize_seconds', 'network_seconds',
+    'parse_seconds', 'request_bytes', 'response_bytes', 'records',
+    'retries', 'cache_hits', 'cache_misses',
+)
+
+
+def function_name(functions):
+    """
+    Return the name metrics are recorded under for a list of (controlid,
+    element) pairs: the function, or 'batch' for mixed functions.
+    """
+    tags = set(element.tag for controlid, element in functions)
+    return tags.pop() if len(tags) == 1 else 'batch'
+
+
+class Call(object):
+    """
+    The measurements of a single request, handed to the Metrics when the
+    response has been consumed.  Times are in seconds; 'network' includes
+    waiting for the gateway and reading the response.
+    """
+    __slots__ = ('metrics', 'function', 'serialize', 'network', 'parse',
+                 'request_bytes', 'response_bytes', 'records', 'ok')
+
+    def __init__(self, metrics, function):
+        self.metrics = metrics
+        self.function = function
+        self.serialize = self.network = self.parse = 0.0
+        self.request_bytes = self.response_bytes = self.records = 0
+        self.ok = False
+
+    def timed(self, chunks):
+        """
+        Iterate over 'chunks', adding the time spent waiting for each one
+        to 'network'.
+        """
+        chunks = iter(chunks)
+        while True:
+            start = timer()
+            chunk = next(chunks, None)
+            self.network += timer() - start
+            if chunk is None:
+                return
+            yield chunk
+
+    def done(self, ok=True):
+        self.ok = ok
+        self.metrics.add(self)
+
+
+class Metrics(object):
+    """
+    Collects the measurements of every request made by an API instance,
+    summed by function, plus retries and result cache hits and misses:
+
+        metrics = Metrics()
+        api = IntacctApi(..., metrics=metrics)
+        ...
+        metrics.snapshot()['readByQuery']['network_seconds']
+        print(metrics.render())
+
+    Callables in 'callbacks' are called with each finished Call, e.g. to
+    forward them to another monitoring system.  Without a Metrics object
+    nothing is measured.
+    """
+    def __init__(self, callbacks=None):
+        self.callbacks = list(callbacks or [])
+        self.functions = {}
+        self.lock = threading.Lock()
+
+    def _counters(self, function):
+        counters = self.functions.get(function)
+        if counters is None:
+            counters = self.functions[function] = dict.fromkeys(fields, 0)
+        return counters
+
+    def add(self, call):
+        with self.lock:
+            counters = self._counters(call.function)
+            counters['calls'] += 1
+            counters['errors'] += not call.ok
+            counters['serialize_seconds'] += call.serialize
+            counters['network_seconds'] += call.network
+            counters['parse_seconds'] += call.parse
+            counters['request_bytes'] += call.request_bytes
+            counters['response_bytes'] += call.response_bytes
+            counters['records'] += call.records
+        for callback in self.callbacks:
+            callback(call)
+
+    def count(self, function, name, n=1):
+        """
+        Add 'n' to the counter 'name' of 'function'.
+        """
+        with self.lock:
+            self._counters(function)[name] += n
+
+    def snapshot(self):
+        """
+        Return a copy of the counters as {function: {name: value}}.
+        """
+        with self.lock:
+            return dict((function, dict(counters))
+                        for function, counters in self.functions.items())
+
+    def reset(self):
+        with self.lock:
+            self.functions.clear()
+
+    def render(self, prefix='intacct'):
+        """
+        Return the counters in the Prometheus text format.
+        """
+        snapshot = self.snapshot()
+        lines = []
+        for name in fields:
+            metric = '%s_%s_total' % (prefix, name)
+            lines.append('# TYPE %s counter' % metric)
+            for function in sorted(snapshot):
+                lines.append('%s{function="%s"} %s' % (
+                    metric, function, snapshot[function][name]))
+        return '\n'.join(lines) + '\n'
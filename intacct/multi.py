@@ -0,0 +1,129 @@
+"""
+intacct.multi
+~~~~~~~~~~~~~
+
+This module implements a client running the same calls for many
+companies (or entities) at once.
+
+"""
+
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
+log = logging.getLogger(__name__)
+from .api import IntacctApi, fan_in
+from .default import max_concurrency
+from .request import connection_pool
+from .scheduler import Scheduler
+
+
+class MultiCompanyApi(object):
+    """
+    An IntacctApi per company, sharing one pool of connections and worker
+    threads.  Calls are run for every company concurrently and their
+    results are returned as they complete, tagged with the company:
+
+        multi = MultiCompanyApi(
+            ['acme', 'acme-eu'], senderid=..., senderpass=...,
+            userid=..., userpass=..., per_company=2)
+        multi.get_api_session()
+        for company, data in multi.read_by_query('VENDOR'):
+            ...
+
+    'companies' is a list of company ids, or a dict of credentials (e.g.
+    'companyid', 'locationid', 'userid', 'userpass') by the name results
+    are tagged with; the other keyword arguments are shared by all
+    companies and are the same as for IntacctApi.
+
+    Keyword arguments:
+        max_workers   The number of calls in flight at once over all
+                      companies (default: 'max_concurrency').
+        per_company   The number of calls in flight at once per company.
+                      Unless a 'scheduler' is given, a Scheduler with this
+                      concurrency is created.
+    """
+    def __init__(self, companies, max_workers=None, per_company=None,
+                 **kwargs):
+        self.max_workers = max_workers or max_concurrency
+        self.connection = connection_pool(self.max_workers)
+        if per_company and not kwargs.get('scheduler'):
+            kwargs['scheduler'] = Scheduler(concurrency=per_company)
+        if not isinstance(companies, dict):
+            companies = OrderedDict((c, {}) for c in companies)
+        self.apis = OrderedDict()
+        for name, credentials in companies.items():
+            options = dict(kwargs, companyid=name, connection=self.connection)
+            options.update(credentials)
+            self.apis[name] = IntacctApi(**options)
+        self.executor = ThreadPoolExecutor(self.max_workers)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.executor.shutdown()
+        self.connection.close()
+
+    def _companies(self, companies):
+        if companies is None:
+            return list(self.apis.items())
+        return [(name, self.apis[name]) for name in companies]
+
+    def run(self, fn, companies=None, return_exceptions=False):
+        """
+        Call fn(api) for each company (default: all) and yield
+        (company, result) pairs in the order the calls complete.  A failed
+        call raises its exception, after cancelling the calls which have
+        not started, unless 'return_exceptions' is set; the exception is
+        then yielded as the result.
+        """
+        futures = dict(
+            (self.executor.submit(fn, api), name)
+            for name, api in self._companies(companies))
+        try:
+            for future in as_completed(futures):
+                error = future.exception()
+                if error is not None and not return_exceptions:
+                    raise error
+                yield futures[future], \
+                    future.result() if error is None else error
+        finally:
+            for future in futures:
+                future.cancel()
+
+    def map(self, fn, companies=None):
+        """
+        Call fn(api) for each company and return an OrderedDict of the
+        results by company.  Raises the first exception of a failed call.
+        """
+        results = dict(self.run(fn, companies))
+        return OrderedDict(
+            (name, results[name]) for name, api in self._companies(companies))
+
+    def get_api_session(self, companies=None):
+        return self.map(lambda api: api.get_api_session(), companies)
+
+    def read_by_query(self, *args, **kwargs):
+        """
+        Run a query for each company and yield (company, data) pairs as
+        the companies finish; see IntacctApi.read_by_query.
+        """
+        companies = kwargs.pop('companies', None)
+        return self.run(
+            lambda api: api.read_by_query(*args, **kwargs), companies)
+
+    def iter_by_query(self, *args, **kwargs):
+        """
+        Run a query for each company and yield (company, record) pairs as
+        the records arrive from all of them; see IntacctApi.iter_by_query.
+        If a company fails, its exception is raised once the records
+        received before it have been yielded.
+        """
+        companies = self._companies(kwargs.pop('companies', None))
+        return fan_in(self.executor, [
+            (name, partial(api.iter_by_query, *args, **kwargs))
+            for name, api in companies])
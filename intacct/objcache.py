@@ -3,9 +3,26 @@ try:
 except ImportError:
     import pickle
 
+import mmap
+import os
 import os.path
+import struct
+import threading
+import time
+import weakref
 from .api import IntacctApi
-from .default import cache_file, cache_objects
+from .compat import replace
+from .default import cache_file, cache_objects, max_functions
+
+# Cache file header: magic, format version and offset of the index
+MAGIC = b'INTACCT\0'
+VERSION = 2
+HEADER = struct.Struct('>8sHQ')
+# Pickle protocol readable by every supported Python version
+PROTOCOL = 2
+# Instances with their cache file memory mapped, by id
+_mapped = weakref.WeakValueDictionary()
+_mapped_lock = threading.Lock()
 
 
 FIXUP_FIELDS = {
@@ -37,72 +54,243 @@ def fixup(cache):
     for the USERINFO object.  This function adds the missing
     single sign on fields.
     """
-    cache['USERINFO'].update(FIXUP_FIELDS['USERINFO'])
+    if 'USERINFO' in cache:
+        cache['USERINFO'].update(FIXUP_FIELDS['USERINFO'])
+
+
+def cache_path(cache_dir=None):
+    """
+    Return the path of the cache file in 'cache_dir' (default: the home
+    directory of the current user).
+    """
+    cache_dir = cache_dir or os.path.expanduser("~")
+    return os.path.join(cache_dir, cache_file)
+
+
+def parse_type(typeel):
+    """
+    Convert the 'Type' element returned by inspect(detail=1) to the
+    object name and a dict of field attributes.
+    """
+    wanted = ['externalDataName', 'isReadOnly', 'isRequired', 'maxLength']
+    objname = typeel.attrib['Name']
+    p = {}
+    for fields in typeel.findall('Fields/Field'):
+        for field in fields:
+            if field.tag == 'Name':
+                if '.' in field.text:
+                    y = p
+                    for e in field.text.split('.'):
+                        if e not in y:
+                            y[e] = {'_nested': True}
+                        y = y[e]
+                else:
+                    if field.text not in p:
+                        p[field.text] = {}
+                    y = p[field.text]
+            elif field.tag and field.text and field.tag in wanted:
+                y[field.tag] = field.text
+    p['_object_name'] = objname
+    return objname, p
 
 
 class ObjectCache(dict):
+    """
+    The object meta data cache.  The cache file holds a header, one pickled
+    record per object and an index of record offsets by object name (and
+    by the names in 'cache_objects' used to inspect them).  The file is
+    memory mapped and each object is only unpickled when it is first
+    looked up.  Before initialize replaces the file, every instance which
+    has it mapped reads it into memory instead.  Files in the original
+    format, a single pickled dict, are still read, and are replaced on
+    the next initialize.
+    """
     def __init__(self, cache_dir=None):
-        cache_dir = cache_dir or os.path.expanduser("~")
-        self.path = os.path.join(cache_dir, cache_file)
-        cache = {}
+        self.path = cache_path(cache_dir)
+        self.index = {}
+        self.map = None
+        super(ObjectCache, self).__init__()
         if os.path.exists(self.path):
-            with open(self.path, 'r') as cachefile:
-                cache = pickle.loads(cachefile.read())
-        super(ObjectCache, self).__init__(cache)
+            self._open()
+
+    def _open(self):
+        with open(self.path, 'rb') as cachefile:
+            header = cachefile.read(HEADER.size)
+            if not header:
+                return
+            if len(header) < HEADER.size or \
+                    not header.startswith(MAGIC):
+                cachefile.seek(0)
+                self.update(pickle.loads(cachefile.read()))
+                return
+            magic, version, offset = HEADER.unpack(header)
+            if version != VERSION:
+                return
+            self.map = mmap.mmap(
+                cachefile.fileno(), 0, access=mmap.ACCESS_READ)
+        with _mapped_lock:
+            _mapped[id(self)] = self
+        self.index = pickle.loads(self.map[offset:])
+
+    def _unmap(self):
+        """
+        Read the mapped file into memory and close the map, so that the
+        file can be replaced (which fails on Windows while it is mapped).
+        """
+        mapped = self.map
+        if isinstance(mapped, mmap.mmap):
+            self.map = mapped[:]
+            mapped.close()
+
+    def _record(self, name):
+        offset, length, timestamp, objname = self.index[name]
+        return self.map[offset:offset + length]
+
+    def __missing__(self, name):
+        if name not in self.index:
+            raise KeyError(name)
+        objname = self.index[name][3]
+        if dict.__contains__(self, objname):
+            value = dict.__getitem__(self, objname)
+        else:
+            value = pickle.loads(self._record(objname))
+            self[objname] = value
+        self[name] = value
+        return value
+
+    def __contains__(self, name):
+        return dict.__contains__(self, name) or name in self.index
+
+    def get(self, name, default=None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+    def load(self):
+        """
+        Load every object in the cache file.
+        """
+        for name in self.index:
+            self[name]
 
     def dump(self):
         """
         A debug function to display the cache contents.
         """
         from pprint import PrettyPrinter
+        self.load()
         pp = PrettyPrinter(indent=4)
-        pp.pprint(self)
+        pp.pprint(dict(self))
+
+    def stale(self, objects=None, max_age=None):
+        """
+        Return those of 'objects' (default: 'cache_objects') which are
+        missing from the cache file or older than 'max_age' seconds.
+        """
+        now = time.time()
+        return [
+            item for item in objects or cache_objects
+            if item not in self.index or
+            (max_age is not None and now - self.index[item][2] > max_age)
+        ]
 
-    def initialize(self, api):
+    def initialize(self, api, objects=None, max_age=None):
         """
         This method creates a data structure formed by calling 'inspect' on the
         'cache_objects' and writes it to 'cache_file' in the home directory of
         the current user.  This data structure is used to create helper classes
         for creating new objects.
+
+        Only objects which are missing from the file, or older than 'max_age'
+        seconds, are inspected.  The inspects are batched and, when the API
+        has more than one worker, the batches are run concurrently.
         """
         assert isinstance(api, IntacctApi), \
             "ObjectCache requires IntacctApi instance for initialization"
+        stale = self.stale(objects, max_age)
+        if not stale:
+            return
+        chunks = [stale[i:i + max_functions]
+                  for i in range(0, len(stale), max_functions)]
+        inspected = {}
+        for chunk in api.map(lambda chunk: _inspect(api, chunk), chunks):
+            inspected.update(chunk)
+        self._write(inspected)
         self.clear()
-        cache = {}
-        # required = []
-        wanted = ['externalDataName', 'isReadOnly', 'isRequired', 'maxLength']
-        for item in cache_objects:
-            xml = api.inspect(name=item, detail=1)
-            objname = xml.find('operation/result/data/Type').attrib['Name']
-            elements = xml.findall('operation/result/data/Type/Fields/Field')
-            for fields in elements:
-                if objname not in cache:
-                    cache[objname] = {}
-                p = cache[objname]
-                # field_name = None
-                for field in fields:
-                    if field.tag == 'Name':
-                        # field_name = field.text
-                        if '.' in field.text:
-                            y = p
-                            for e in field.text.split('.'):
-                                if e not in y:
-                                    y[e] = {'_nested': True}
-                                y = y[e]
-                        else:
-                            if field.text not in p:
-                                p[field.text] = {}
-                            y = p[field.text]
-                    elif field.tag and field.text and field.tag in wanted:
-                        if field.tag == 'isRequired' and field.text == 'true':
-                            # required.append(field_name)
-                            pass
-                        else:
-                            y[field.tag] = field.text
-            # cache[objname]['__required__'] = required
-            cache[objname]['_object_name'] = objname
-            cache[item] = cache[objname]
-        fixup(cache)
-        with open(self.path, 'w') as cachefile:
-            pickle.dump(cache, cachefile)
-        super(ObjectCache, self).__init__(cache)
+        self.index = {}
+        self.map = None
+        self._open()
+
+    def _write(self, inspected):
+        """
+        Write the cache file, keeping the records of objects which were
+        not inspected and replacing the file atomically.
+        """
+        now = time.time()
+        records = {}
+        names = {}
+        for name, (offset, length, timestamp, objname) in \
+                self.index.items():
+            if name not in inspected:
+                records[objname] = (self._record(name), timestamp)
+                names[name] = objname
+        types = {}
+        for item, (objname, p) in inspected.items():
+            types[objname] = p
+            names[item] = names[objname] = objname
+        fixup(types)
+        for objname, p in types.items():
+            records[objname] = (pickle.dumps(p, PROTOCOL), now)
+        index = {}
+        tmp = self.path + '.tmp'
+        with open(tmp, 'wb') as cachefile:
+            cachefile.write(HEADER.pack(MAGIC, VERSION, 0))
+            offsets = {}
+            for objname, (record, timestamp) in records.items():
+                offsets[objname] = (cachefile.tell(), len(record), timestamp)
+                cachefile.write(record)
+            for name, objname in names.items():
+                index[name] = offsets[objname] + (objname,)
+            offset = cachefile.tell()
+            cachefile.write(pickle.dumps(index, PROTOCOL))
+            cachefile.seek(0)
+            cachefile.write(HEADER.pack(MAGIC, VERSION, offset))
+        with _mapped_lock:
+            for key, cache in list(_mapped.items()):
+                if cache.path == self.path:
+                    cache._unmap()
+                    del _mapped[key]
+        replace(tmp, self.path)
+
+
+def _inspect(api, items):
+    """
+    Inspect 'items' in a single request, returning a dict of
+    item: (objname, fields).
+    """
+    with api.batch() as batch:
+        futures = [(item, batch.inspect(name=item, detail=1))
+                   for item in items]
+    return dict(
+        (item, parse_type(future.result().find('data/Type')))
+        for item, future in futures
+    )
+
+
+_shared = {'cache': None, 'mtime': None}
+_shared_lock = threading.Lock()
+
+
+def shared_cache():
+    """
+    Return the process wide ObjectCache.  It is loaded once and only
+    reloaded when the cache file is modified.
+    """
+    path = cache_path()
+    with _shared_lock:
+        mtime = os.path.getmtime(path) if os.path.exists(path) else None
+        if _shared['cache'] is None or mtime != _shared['mtime']:
+            _shared['cache'] = ObjectCache()
+            _shared['mtime'] = mtime
+        return _shared['cache']
@@ -3,41 +3,78 @@ try:
 except ImportError:
     import xml.etree.ElementTree as ET
 
-from weakref import WeakKeyDictionary
-from .objcache import ObjectCache
+import threading
+from operator import attrgetter
+from .exceptions import ValidationError
+from .compat import string_types
+from .objcache import shared_cache
+from .request import tostring
 from .types import IntacctObjectType
+from .validation import Validator
 
 
 def _conditional_setattr(self, key, value):
     """
     This method insures that only attributes which were set during class
-    creation by IntacctMetaclass are settable.
+    creation by IntacctMetaclass are settable, and that strings are no
+    longer than the field's maxLength.
     """
     if not hasattr(self, key):
         raise RuntimeError("Invalid attribute '%s' for objects of type '%s'" %
                            (key, self.__class__.__name__))
+    limit = self._limits.get(key)
+    if limit is not None and isinstance(value, string_types) and \
+            len(value) > limit:
+        raise ValidationError(self.__class__.__name__, [
+            (key, 'is longer than %d characters' % limit)])
     object.__setattr__(self, key, value)
 
 
-def _buildxml(el, o):
+def _compile_serializer(fields, nested):
     """
-    Create XML by recursing through the object
+    Create a function which appends an element for each field of an object
+    that has a value, in the fixed order of 'fields', to the element it is
+    passed.  Nested objects are only added if one of their fields is set.
+    The function returns True if anything was added.
     """
-    for attr in dir(o):
-        if attr.startswith('_'):
-            continue
-        value = getattr(o, attr)
-        if not value:
-            continue
-        if type(value) in [int, float]:
-            value = str(value)
-        if type(value) != str:
-            if not any([not a.startswith('_') and getattr(value, a)
-                        for a in dir(value)]):
-                            continue
-            _buildxml(ET.SubElement(el, value.__class__.__name__), value)
-        else:
-            ET.SubElement(el, attr).text = value
+    plan = []
+    for name in fields:
+        cls = nested.get(name)
+        plan.append((name, attrgetter(name), cls and cls._serialize))
+
+    def serialize(o, el):
+        added = False
+        for name, get, serialize_nested in plan:
+            value = get(o)
+            if not value:
+                continue
+            if serialize_nested is not None:
+                child = ET.Element(name)
+                if serialize_nested(value, child):
+                    el.append(child)
+                    added = True
+                continue
+            if type(value) in (int, float):
+                value = str(value)
+            ET.SubElement(el, name).text = value
+            added = True
+        return added
+    return staticmethod(serialize)
+
+
+def _compile_init(fields, nested):
+    """
+    Create an __init__ which sets every field to None and gives each object
+    its own instances of the nested objects.
+    """
+    nested = list(nested.items())
+
+    def __init__(self):
+        for name in fields:
+            object.__setattr__(self, name, None)
+        for name, cls in nested:
+            object.__setattr__(self, name, cls())
+    return __init__
 
 
 def _to_element_tree(self):
@@ -45,52 +82,106 @@ def _to_element_tree(self):
     Convert object to an ElementTree
     """
     el = ET.Element(self.__class__.__name__)
-    _buildxml(el, self)
+    self._serialize(self, el)
     return el
 
 
-class ObjectDescriptor(object):
-    def __init__(self):
-        self.data = WeakKeyDictionary()
+def _validate(self, mode='create'):
+    """
+    Raise a ValidationError if the object would be rejected by a 'create'
+    (or an 'update') according to the ObjectCache.
+    """
+    self._validator.check(self(), mode)
 
-    def __get__(self, instance, owner):
-        # print "(__get__) instance: %s, owner: %s" % (instance, owner)
-        return self.data.get(instance)
 
-    def __set__(self, instance, value):
-        # print "(__set__) instance: %s, value: %s" % (instance, value)
-        self.data[instance] = value
+def _slotted_class(name, bases, dct, properties, metaclass=type,
+                   nested=True):
+    """
+    Create a class whose fields are the dict valued entries of
+    'properties', stored in __slots__.  Only top level fields may be
+    nested objects.
+    """
+    fields = tuple(sorted(
+        prop for prop, propval in properties.items()
+        if type(propval) is dict and not prop.startswith('_')
+    ))
+    classes = {}
+    for prop in fields:
+        dct.pop(prop, None)
+        if nested and properties[prop].get('_nested'):
+            classes[prop] = _slotted_class(
+                prop, (object,), {}, properties[prop], nested=False)
+    dct['__slots__'] = fields
+    dct['_fields'] = fields
+    dct['_validator'] = validator = Validator(properties)
+    dct['_limits'] = validator.limits
+    dct['_serialize'] = _compile_serializer(fields, classes)
+    dct['__init__'] = _compile_init(fields, classes)
+    dct['__setattr__'] = _conditional_setattr
+    return type.__new__(metaclass, name, bases, dct)
 
 
 class IntacctMetaclass(type):
     """
-    Metaclass for creating an IntacctClass
+    Metaclass for creating an IntacctClass.  Field values are kept in
+    __slots__ derived from the ObjectCache and serialized by a function
+    compiled once per class, and checked against the field attributes by
+    a Validator compiled once per class.
     """
     def __new__(cls, name, cache, bases, dct):
         properties = cache.get(name)
         if not properties:
             raise RuntimeError("Object type '%s' not found in cache" % name)
-        for prop, propval in properties.iteritems():
-            if type(propval) is not dict:
-                continue
-            if propval.get('_nested'):
-                attributes = {'__setattr__': _conditional_setattr}
-                for aname, aval in propval.iteritems():
-                    attributes[aname] = ObjectDescriptor()
-                dct[prop] = type(prop, (), attributes)()
-            else:
-                dct[prop] = ObjectDescriptor()
-        dct['__setattr__'] = _conditional_setattr
-        dct['__str__'] = lambda x: ET.tostring(_to_element_tree(x))
+        dct['__str__'] = lambda x: tostring(_to_element_tree(x))
         dct['__call__'] = _to_element_tree
-        return super(IntacctMetaclass, cls).__new__(cls, name, bases, dct)
+        dct['validate'] = _validate
+        return _slotted_class(name, bases, dct, properties, cls)
+
+
+class _Registry(object):
+    """
+    Process wide registry of the classes created by ObjectFactory.  The
+    classes are discarded when the shared ObjectCache is reloaded.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.cache = None
+        self.classes = {}
+
+    def _load(self):
+        cache = shared_cache()
+        if cache is not self.cache:
+            self.cache = cache
+            self.classes = {}
+        return cache
+
+    def get(self, typename, kwargs):
+        """
+        Return the class for 'typename', creating it on first use.
+        """
+        with self.lock:
+            cache = self._load()
+            try:
+                key = (typename, tuple(sorted(kwargs.items())))
+                hash(key)
+            except TypeError:
+                key = None
+            cls = self.classes.get(key)
+            if cls is None:
+                cls = IntacctMetaclass.__new__(
+                    IntacctMetaclass, typename, cache, (IntacctObjectType,),
+                    dict(**kwargs)
+                )
+                if key is not None:
+                    self.classes[key] = cls
+            return cls
+
+
+_registry = _Registry()
 
 
 def ObjectFactory(typename, **kwargs):
     """
     Factory for creating Intacct objects
     """
-    cache = ObjectCache()
-    return IntacctMetaclass.__new__(
-        IntacctMetaclass, typename, cache, (IntacctObjectType,), dict(**kwargs)
-    )()
+    return _registry.get(typename, kwargs)()
@@ -3,16 +3,37 @@ try:
 except ImportError:
     import xml.etree.ElementTree as ET
 
+import copy
 import logging
+import threading
 log = logging.getLogger(__name__)
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectTimeout, RequestException
 from requests.sessions import Session
 from collections import OrderedDict
-from .default import api_url
+from uuid import uuid4
+from xml.sax.saxutils import escape
+from .default import api_url, chunk_size, max_workers
+from .exceptions import IntacctError, AuthenticationError, TransportError, \
+    ThrottledError
+from .metrics import Call, function_name, timer
+from .columns import Texts
+from . import formats
+
+# HTTP headers sent with every request
+headers = {'Content-Type': 'x-intacct-xml-request'}
+
+
+def tostring(el):
+    """
+    Return the XML text of 'el' as a string rather than bytes.
+    """
+    return ET.tostring(el).decode('utf-8')
 
 
 def ElementWithSubElements(name, d):
     e = ET.Element(name)
-    for key, value in d.iteritems():
+    for key, value in d.items():
         ET.SubElement(e, key).text = value
     return e
 
@@ -42,49 +63,446 @@ def Credentials(**kwargs):
         ('companyid', kwargs.get('companyid')),
         ('password', kwargs.get('userpass')),
     ])
+    if kwargs.get('locationid'):
+        login['locationid'] = kwargs['locationid']
     return control, login
 
 
-class IntacctRequest(object):
+class _ResponseTarget(object):
+    """
+    Parser target which builds the response tree.  When 'stream' is set,
+    each record found below 'operation/result/data' is detached from the
+    tree as soon as it is complete and queued in 'records' so that it can
+    be released once the consumer is done with it.  Records returned as
+    JSON or CSV text are decoded into elements as the text arrives.
+
+    When 'columnar' is set, no record elements are built: the text of each
+    field is added to 'texts' (see columns.Texts) as it is parsed.
+    """
+    def __init__(self, stream=False, columnar=False):
+        self.builder = ET.TreeBuilder()
+        self.stream = stream
+        self.path = []
+        self.control = None
+        self.authentication = None
+        self.status = None
+        self.page = None
+        self.decoder = None
+        self.records = []
+        self.texts = Texts() if columnar else None
+        # Set while inside the records of a columnar page
+        self.fields = False
+        self.field = None
+        self.nested = False
+        self.text = []
+
+    def start(self, tag, attrib):
+        path = self.path
+        path.append(tag)
+        if self.fields:
+            depth = len(path)
+            if depth == 5:
+                self.texts.start()
+            elif depth == 6:
+                self.field = tag
+                self.nested = False
+                self.text = []
+            elif depth == 7:
+                self.field = path[5] + '.' + tag
+                self.nested = True
+                self.text = []
+            return None
+        el = self.builder.start(tag, attrib)
+        if tag == 'data' and self.status == 'success' and \
+                path[-2] == 'result':
+            self.page = el
+            self.fields = self.texts is not None
+        return el
+
+    def _decoded(self, records):
+        if self.texts is not None:
+            return
+        if self.stream:
+            self.records.extend(records)
+        else:
+            self.page.extend(records)
+
+    def _end_field(self):
+        depth = len(self.path)
+        if depth == 7 or depth == 6 and not self.nested:
+            self.texts.add(self.field, ''.join(self.text) or None)
+            self.field = None
+        elif depth == 5:
+            self.texts.end()
+        self.path.pop()
+
+    def end(self, tag):
+        path = self.path
+        if self.fields and len(path) > 4:
+            return self._end_field()
+        if self.decoder is not None and len(path) == 4:
+            self._decoded(self.decoder.close())
+            self.decoder = None
+        if len(path) == 4:
+            self.fields = False
+        el = self.builder.end(tag)
+        if len(path) == 5 and self.stream and self.page is not None and \
+                path[-2] == 'data':
+            self.page.remove(el)
+            self.records.append(el)
+        elif tag == 'status' and path[-2] == 'result' and \
+                self.status is None:
+            # operation/result/status precedes any data, so failures are
+            # known before records are parsed.
+            self.status = el.text
+        elif tag == 'status' and path[-2] == 'control':
+            self.control = el.text
+        elif tag == 'status' and path[-2] == 'authentication':
+            self.authentication = el.text
+        path.pop()
+        return el
+
+    def data(self, text):
+        if self.fields and len(self.path) > 4:
+            if self.field is not None:
+                self.text.append(text)
+            return
+        if self.page is not None and len(self.path) == 4 and \
+                self.path[-1] == 'data':
+            if self.decoder is None and text.strip():
+                texts = self.texts
+                self.decoder = formats.decoder(
+                    text, self.page.get('listtype') or 'record',
+                    formats.record if texts is None else texts.record)
+            if self.decoder is not None:
+                self._decoded(self.decoder.feed(text))
+                return
+        self.builder.data(text)
+
+    def close(self):
+        return self.builder.close()
+
+
+class ResponseParser(object):
     """
-    Create XML and post request
+    Incrementally parse the body of a gateway response as it is pushed with
+    feed().  In streaming mode each record is returned by the feed() call
+    which completed it; otherwise the complete tree is returned by close().
+    Unless 'strict' is False, the status of the (first) function result
+    must be 'success'; otherwise only the control status is checked.
+    Parse time, bytes and records are added to 'call' if given.  When
+    'columnar' is set, records are collected in 'texts' instead.
+    """
+    def __init__(self, status_code=200, stream=False, strict=True,
+                 call=None, columnar=False):
+        self.status_code = status_code
+        self.strict = strict
+        self.call = call
+        self.target = _ResponseTarget(stream, columnar)
+        self.parser = ET.XMLParser(target=self.target)
+        self.root = None
+
+    @property
+    def data(self):
+        """
+        The 'operation/result/data' element; in streaming mode only its
+        attributes (e.g. 'numremaining') and unconsumed records remain.
+        """
+        return self.target.page
+
+    @property
+    def texts(self):
+        """
+        The columns.Texts of the records of a columnar response.
+        """
+        return self.target.texts
+
+    def error(self, response, root=None, cls=None, retry_after=None):
+        message = "Status: %d, Response: '%s'" % (self.status_code, response)
+        if cls is None and self.status_code in (429, 503):
+            return ThrottledError(message, self.status_code, root,
+                                  retry_after)
+        if cls is None:
+            cls = TransportError if self.status_code >= 500 else IntacctError
+        return cls(message, self.status_code, root)
+
+    def feed(self, chunk):
+        """
+        Parse 'chunk' and return a list of the records it completed.
+        """
+        call = self.call
+        try:
+            if call is None:
+                self.parser.feed(chunk)
+            else:
+                start = timer()
+                self.parser.feed(chunk)
+                call.parse += timer() - start
+                call.response_bytes += len(chunk)
+        except (ET.ParseError, ValueError) as e:
+            raise self.error(e)
+        records, self.target.records = self.target.records, []
+        if call is not None:
+            call.records += len(records)
+        return records
+
+    def close(self):
+        """
+        Finish parsing, check the status and return the root element.
+        """
+        call = self.call
+        try:
+            if call is None:
+                self.root = self.parser.close()
+            else:
+                start = timer()
+                self.root = self.parser.close()
+                call.parse += timer() - start
+                if self.target.page is not None:
+                    call.records += len(self.target.page)
+                if self.target.texts is not None:
+                    call.records += self.target.texts.rows
+        except (ET.ParseError, ValueError) as e:
+            raise self.error(e)
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("Response: %s", tostring(self.root))
+        target = self.target
+        if target.authentication == 'failure':
+            raise self.error(
+                tostring(self.root), self.root, AuthenticationError)
+        status = target.status if self.strict else target.control
+        if status != 'success':
+            raise self.error(tostring(self.root), self.root)
+        return self.root
+
+
+class Response(ResponseParser):
+    """
+    Parse a response as it is read from the connection.  Iterating a
+    streaming response yields each record as soon as it has been parsed.
+    """
+    def __init__(self, r, stream=False, strict=True, call=None,
+                 columnar=False):
+        super(Response, self).__init__(
+            r.status_code, stream, strict, call, columnar)
+        self.http = r
+        if not r.ok:
+            try:
+                raise self.error(
+                    r.text, retry_after=r.headers.get('Retry-After'))
+            finally:
+                r.close()
+                if call is not None:
+                    call.done(False)
+
+    def __iter__(self):
+        r = self.http
+        call = self.call
+        chunks = r.iter_content(chunk_size)
+        if call is not None:
+            chunks = call.timed(chunks)
+        ok = False
+        try:
+            for chunk in chunks:
+                for record in self.feed(chunk):
+                    yield record
+            self.close()
+            ok = True
+        except RequestException as e:
+            raise TransportError(str(e), r.status_code)
+        except GeneratorExit:
+            # The consumer stopped reading; not a failure of the call.
+            ok = True
+            raise
+        finally:
+            self.discard()
+            if call is not None:
+                call.done(ok)
+
+    def discard(self):
+        """
+        Close the connection, without reading the rest of the body if it
+        has not been read.
+        """
+        self.http.close()
+
+    def read(self):
+        """
+        Consume the response and return the root element.
+        """
+        for record in self:
+            pass
+        return self.root
+
+
+class Envelope(object):
+    """
+    Holds the control and authentication blocks and wraps functions in a
+    request envelope.  Everything but the functions is serialized once, as
+    a template of the URL and the bytes around the control id and the
+    'content' element, and only rebuilt when the session changes.  A
+    single instance may be shared between threads.
+
+    When 'uniqueid' is set, the gateway refuses to run a request whose
+    control id it has seen before, so each request gets a new control id
+    unless the caller passes the same one again to retry it safely.
     """
     def __init__(self, **kwargs):
-        self.url = api_url
-        self.root = ET.Element('request')
         control, login = Credentials(**kwargs)
         self.controlid = control['controlid']
-        self.root.append(ElementWithSubElements('control', control))
-        operation = ET.SubElement(self.root, 'operation')
-        self.authentication = ET.SubElement(operation, 'authentication')
-        self.authentication.append(ElementWithSubElements('login', login))
-        content = ET.SubElement(operation, 'content')
-        self.function = ET.SubElement(content, 'function')
-        self.connection = Session()
-        self.connection.headers.update(
-            {'Content-Type': 'x-intacct-xml-request'}
-        )
+        self.unique = control['uniqueid'] == 'true'
+        self.control = ElementWithSubElements('control', control)
+        # Identifies the credentials, e.g. for sharing sessions
+        self.key = (control['senderid'], login['companyid'], login['userid'])
+        if 'locationid' in login:
+            self.key += (login['locationid'],)
+        self.secret = control['password'] + login['password']
+        authentication = ET.Element('authentication')
+        authentication.append(ElementWithSubElements('login', login))
+        self.login = self._template(
+            kwargs.get('url') or api_url, authentication)
+        # Replaced as a whole so concurrent calls see a consistent envelope.
+        self.template = self.login
+
+    def _template(self, url, authentication):
+        root = ET.Element('request')
+        control = copy.deepcopy(self.control)
+        root.append(control)
+        controlid = uuid4().hex
+        control.find('controlid').text = controlid
+        operation = ET.SubElement(root, 'operation')
+        operation.append(authentication)
+        content = uuid4().hex
+        ET.SubElement(operation, 'content').text = content
+        head, rest = ET.tostring(root).split(controlid.encode('ascii'))
+        middle, suffix = rest.split(content.encode('ascii'))
+        return url, head, middle, suffix
+
+    def new_controlid(self):
+        """
+        Return a control id for a request which may have to be retried, or
+        None if control ids need not be unique.
+        """
+        return uuid4().hex if self.unique else None
+
+    def session_template(self, sessionid, endpoint):
+        """
+        Return a template authenticating with 'sessionid'.
+        """
+        authentication = ET.Element('authentication')
+        ET.SubElement(authentication, 'sessionid').text = sessionid
+        return self._template(endpoint, authentication)
 
     def set_session_id(self, sessionid, endpoint):
-        self.authentication.clear()
-        self.url = endpoint
-        ET.SubElement(self.authentication, 'sessionid').text = sessionid
-
-    def __call__(self, element):
-        self.function.clear()
-        self.function.attrib.update(controlid=self.controlid)
-        self.function.append(element)
-        xmltext = ET.tostring(self.root)
+        self.template = self.session_template(sessionid, endpoint)
+
+    def envelope(self, functions, template=None, controlid=None):
+        """
+        Return the URL and serialized request for a list of
+        (controlid, element) pairs, using 'template' instead of the current
+        session and 'controlid' for the request if given.
+        """
+        url, head, middle, suffix = template or self.template
+        if controlid is None:
+            controlid = uuid4().hex if self.unique else self.controlid
+        parts = [head, escape(controlid).encode('utf-8'), middle]
+        for controlid, element in functions:
+            function = ET.Element('function')
+            function.attrib.update(controlid=controlid)
+            function.append(element)
+            parts.append(ET.tostring(function))
+        parts.append(suffix)
+        xmltext = b''.join(parts)
         log.debug("Request: %s", xmltext)
-        r = self.connection.post(self.url, data=xmltext)
-        log.debug("Response: %s", ' '.join(r.text.splitlines()))
+        return url, xmltext
+
+
+def connection_pool(size):
+    """
+    Return a requests Session keeping up to 'size' connections per host.
+    """
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=size)
+    connection = Session()
+    connection.mount('https://', adapter)
+    connection.mount('http://', adapter)
+    connection.headers.update(headers)
+    connection.pool_size = size
+    return connection
+
+
+_pool_lock = threading.Lock()
+
+
+def grow_pool(connection, size):
+    """
+    Let a connection from connection_pool() keep at least 'size'
+    connections per host.  Other Sessions are left as they are.
+    """
+    with _pool_lock:
+        if getattr(connection, 'pool_size', size) >= size:
+            return
+        old = connection.get_adapter('https://')
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=size)
+        connection.mount('https://', adapter)
+        connection.mount('http://', adapter)
+        connection.pool_size = size
+        old.close()
+
+
+class IntacctRequest(Envelope):
+    """
+    Create XML and post request.  Up to 'max_workers' connections are
+    pooled, unless a 'connection' from connection_pool() is shared with
+    other instances.  Each request is measured if 'metrics' is given.
+    """
+    def __init__(self, **kwargs):
+        super(IntacctRequest, self).__init__(**kwargs)
+        self.metrics = kwargs.get('metrics')
+        self.connection = kwargs.get('connection') or connection_pool(
+            kwargs.get('max_workers') or max_workers)
+
+    def _post(self, functions, stream=False, strict=True, template=None,
+              controlid=None, columnar=False):
+        call = None
+        if self.metrics is not None:
+            call = Call(self.metrics, function_name(functions))
+            start = timer()
+        url, xmltext = self.envelope(functions, template, controlid)
+        if call is not None:
+            sent = timer()
+            call.serialize = sent - start
+            call.request_bytes = len(xmltext)
         try:
-            r.raise_for_status()
-            xml = ET.fromstring(r.text)
-            status = getattr(xml.find('operation/result/status'), 'text')
-            if status == 'success':
-                return xml
-        except:
-            pass
-        raise Exception("Status: %d, Response: '%s'" % (
-            r.status_code, r.text))
+            r = self.connection.post(url, data=xmltext, stream=True)
+        except RequestException as e:
+            if call is not None:
+                call.done(False)
+            raise TransportError(
+                str(e), sent=not isinstance(e, ConnectTimeout))
+        if call is not None:
+            call.network = timer() - sent
+        return Response(r, stream, strict, call, columnar)
+
+    def stream(self, element, template=None, controlid=None,
+               columnar=False):
+        """
+        Post 'element' and return a streaming Response; records are parsed
+        and handed out one at a time while the body is still arriving, or
+        collected in its 'texts' if 'columnar' is set.
+        """
+        return self._post([(self.controlid, element)], stream=True,
+                          template=template, controlid=controlid,
+                          columnar=columnar)
+
+    def call(self, functions, template=None, controlid=None):
+        """
+        Post a list of (controlid, element) pairs in a single request and
+        return the response.  The status of each 'operation/result' must
+        be checked by the caller.
+        """
+        return self._post(functions, strict=False, template=template,
+                          controlid=controlid).read()
+
+    def __call__(self, element, template=None, controlid=None):
+        return self._post([(self.controlid, element)], template=template,
+                          controlid=controlid).read()
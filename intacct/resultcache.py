@@ -0,0 +1,120 @@
+"""
+In-process cache for the results of read, readByName and inspect.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+# Functions whose results may be cached
+cacheable = ('read', 'readByName', 'inspect')
+
+
+def cache_key(element):
+    """
+    Return the cache key and object name for a function element, or
+    (None, None) if its result may not be cached.
+    """
+    if element.tag not in cacheable:
+        return None, None
+    obj = element.findtext('object') or element.findtext('name') or ''
+    key = (
+        element.tag,
+        tuple(sorted(element.attrib.items())),
+        tuple((child.tag, child.text) for child in element),
+    )
+    return key, obj.upper()
+
+
+def written(element):
+    """
+    Return the names of the objects changed by a create, update or delete
+    function element.
+    """
+    if element.tag == 'delete':
+        return set([(element.findtext('object') or '').upper()])
+    if element.tag in ('create', 'update'):
+        return set(child.tag.upper() for child in element)
+    return set()
+
+
+class ResultCache(object):
+    """
+    A bounded LRU cache of function results with per-object time to live
+    and hit/miss counters.  Entries for an object are dropped whenever a
+    create, update or delete of that object goes through the API.  Cached
+    elements are shared between callers and must not be modified.
+
+    Keyword arguments:
+        maxsize     The maximum number of entries (default: 1024).
+        ttl         Seconds an entry stays valid, or None for no limit
+                    (default: 300).
+        ttls        A dict of per-object TTLs overriding 'ttl', keyed by
+                    object name, e.g. {'VENDOR': 3600}.
+    """
+    def __init__(self, maxsize=1024, ttl=300, ttls=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.ttls = dict((k.upper(), v) for k, v in (ttls or {}).items())
+        self.hits = 0
+        self.misses = 0
+        self.entries = OrderedDict()
+        self.generations = {}
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def generation(self, obj):
+        """
+        Return a token which set() uses to discard results read before the
+        object was last invalidated.
+        """
+        return self.generations.get(obj, 0)
+
+    def get(self, key):
+        """
+        Return (True, value) for a live entry, otherwise (False, None).
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                obj, expires, value = entry
+                if expires is None or expires > time.time():
+                    self.entries.pop(key)
+                    self.entries[key] = entry
+                    self.hits += 1
+                    return True, value
+                del self.entries[key]
+            self.misses += 1
+            return False, None
+
+    def set(self, key, obj, value, generation):
+        with self.lock:
+            if self.generations.get(obj, 0) != generation:
+                return
+            ttl = self.ttls.get(obj, self.ttl)
+            expires = None if ttl is None else time.time() + ttl
+            self.entries.pop(key, None)
+            self.entries[key] = (obj, expires, value)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, objects=None):
+        """
+        Drop the entries for the given object names, or all entries.
+        """
+        with self.lock:
+            if objects is None:
+                self.entries.clear()
+                return
+            objects = set(obj.upper() for obj in objects)
+            for obj in objects:
+                self.generations[obj] = self.generations.get(obj, 0) + 1
+            for key in [key for key, entry in self.entries.items()
+                        if entry[0] in objects]:
+                del self.entries[key]
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'size': len(self.entries)}
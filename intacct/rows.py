@@ -0,0 +1,128 @@
+"""
+intacct.rows
+~~~~~~~~~~~~
+
+Compact rows for query results.  A record element holds an Element, with
+its own tag, attrib dict and text, for every field; a Row is a tuple of
+the field values, and the field names are held once by a class shared by
+all the rows of an object with the same fields.
+
+"""
+
+import threading
+from collections import OrderedDict
+from .compat import string_types
+
+
+class Row(tuple):
+    """
+    The field values of a record, in the order of the '_fields' of its
+    class.  Fields are read as attributes or by name, as in a dict, and
+    fields of nested objects are named 'OBJECT.FIELD':
+
+        row.NAME, row['NAME'], row.get('CONTACTINFO.EMAIL1')
+
+    Indexing with an integer, iteration and comparison are those of a
+    tuple, as for sqlite3.Row.  Missing and empty values are None.
+    """
+    __slots__ = ()
+    _fields = ()
+    _index = {}
+
+    def __getattr__(self, name):
+        try:
+            return tuple.__getitem__(self, self._index[name])
+        except KeyError:
+            raise AttributeError(
+                "'%s' row has no field '%s'" % (self.__class__.__name__, name))
+
+    def __getitem__(self, key):
+        if isinstance(key, string_types):
+            return tuple.__getitem__(self, self._index[key])
+        return tuple.__getitem__(self, key)
+
+    def __repr__(self):
+        return '%s(%s)' % (self.__class__.__name__, ', '.join(
+            '%s=%r' % item for item in zip(self._fields, self)))
+
+    def __reduce__(self):
+        return _row, (self.__class__.__name__, self._fields, tuple(self))
+
+    def get(self, key, default=None):
+        index = self._index.get(key)
+        return default if index is None else tuple.__getitem__(self, index)
+
+    def keys(self):
+        return list(self._fields)
+
+    def values(self):
+        return list(self)
+
+    def items(self):
+        return list(zip(self._fields, self))
+
+    def _asdict(self):
+        return OrderedDict(zip(self._fields, self))
+
+
+class _Classes(object):
+    """
+    Process wide Row classes by object name and fields.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.classes = {}
+
+    def get(self, name, fields):
+        key = (name, fields)
+        cls = self.classes.get(key)
+        if cls is None:
+            with self.lock:
+                cls = self.classes.get(key)
+                if cls is None:
+                    cls = self.classes[key] = type(str(name), (Row,), {
+                        '__slots__': (),
+                        '_fields': fields,
+                        '_index': dict(
+                            (field, i) for i, field in enumerate(fields)),
+                    })
+        return cls
+
+
+_classes = _Classes()
+
+
+def row_class(name, fields):
+    """
+    Return the Row class of object 'name' with the tuple of 'fields'.
+    """
+    return _classes.get(name, tuple(fields))
+
+
+def _row(name, fields, values):
+    return row_class(name, fields)(values)
+
+
+def compact(records):
+    """
+    Generator which converts record elements to Rows.  Records are
+    expected to have the same fields, in the same order, as the one
+    before them, so a class is only looked up when the fields change.
+    """
+    cls = None
+    for record in records:
+        fields = []
+        values = []
+        for child in record:
+            if len(child):
+                for sub in child:
+                    fields.append(child.tag + '.' + sub.tag)
+                    values.append(sub.text)
+            else:
+                fields.append(child.tag)
+                values.append(child.text)
+        fields = tuple(fields)
+        if cls is None or cls._fields != fields or \
+                cls.__name__ != record.tag:
+            cls = row_class(record.tag, fields)
+        yield cls(values)
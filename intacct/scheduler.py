@@ -0,0 +1,180 @@
+"""
+intacct.scheduler
+~~~~~~~~~~~~~~~~~
+
+Rate limiting and retries for calls to the gateway.
+
+"""
+
+import logging
+import random
+import threading
+import time
+log = logging.getLogger(__name__)
+from . import default
+from .exceptions import IntacctError, ThrottledError, TransportError
+
+
+class TokenBucket(object):
+    """
+    Allows 'rate' calls per second on average, with bursts of up to
+    'burst' calls.
+    """
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = burst or max(1, self.rate)
+        self.tokens = self.capacity
+        self.stamp = time.time()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.time()
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def acquire(self):
+        """
+        Wait until a call is allowed.
+        """
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """
+        Hold back all calls for 'seconds', e.g. after being throttled.
+        """
+        with self.lock:
+            self._refill()
+            self.tokens = min(self.tokens, -seconds * self.rate)
+
+
+class _Limit(object):
+    def __init__(self, rate, burst, concurrency):
+        self.bucket = TokenBucket(rate, burst) if rate else None
+        self.semaphore = \
+            threading.BoundedSemaphore(concurrency) if concurrency else None
+
+    def __enter__(self):
+        if self.semaphore is not None:
+            self.semaphore.acquire()
+        if self.bucket is not None:
+            self.bucket.acquire()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.semaphore is not None:
+            self.semaphore.release()
+
+
+class Scheduler(object):
+    """
+    Limits the calls made to each company and retries those which fail
+    with a retryable error, waiting between attempts with jittered
+    exponential backoff:
+
+        api = IntacctApi(..., scheduler=Scheduler(rate=5, concurrency=4))
+
+    Throttling (ThrottledError, or a gateway error listed in 'errors')
+    and failures which happened before the request was sent are always
+    retried.  Other transport errors are only retried for idempotent
+    calls: reads, and writes when the request is sent with 'uniqueid' so
+    that the gateway refuses to run it twice.
+
+    A call counts against 'concurrency' until its response arrives; the
+    body of a streaming query is read without holding on to the limit, so
+    that calls may be made while the records are being consumed.
+
+    Keyword arguments:
+        rate          Calls per second per company (default: unlimited).
+        burst         Calls which may be made at once before 'rate'
+                      applies (default: rate).
+        concurrency   Calls in flight at once per company (default:
+                      unlimited).
+        retries       The number of times a call is retried.
+        backoff       Seconds before the first retry; doubled each time.
+        max_backoff   Upper bound for the delay between retries.
+        errors        Gateway error numbers ('errorno') which mean the
+                      request was throttled.
+    """
+    def __init__(self, rate=None, burst=None, concurrency=None, retries=None,
+                 backoff=None, max_backoff=None, errors=()):
+        self.rate = rate
+        self.burst = burst
+        self.concurrency = concurrency
+        self.retries = default.max_retries if retries is None else retries
+        self.backoff = default.retry_backoff if backoff is None else backoff
+        self.max_backoff = default.max_backoff \
+            if max_backoff is None else max_backoff
+        self.errors = set(errors)
+        self.limits = {}
+        self.lock = threading.Lock()
+
+    def _limit(self, company):
+        with self.lock:
+            limit = self.limits.get(company)
+            if limit is None:
+                limit = self.limits[company] = _Limit(
+                    self.rate, self.burst, self.concurrency)
+            return limit
+
+    def throttled(self, error):
+        """
+        Return True if 'error' means the gateway is over its rate limits.
+        """
+        if isinstance(error, ThrottledError):
+            return True
+        if isinstance(error, IntacctError) and self.errors:
+            return any(e.get('errorno') in self.errors for e in error.errors)
+        return False
+
+    def retryable(self, error, idempotent=True):
+        if self.throttled(error):
+            return True
+        if isinstance(error, TransportError):
+            return idempotent or not error.sent
+        return False
+
+    def delay(self, attempt, error=None):
+        """
+        Return the seconds to wait before retry number 'attempt' (from 0):
+        a random time up to the exponential backoff, or as long as the
+        gateway asked for.
+        """
+        retry_after = getattr(error, 'retry_after', None)
+        if retry_after is not None:
+            return retry_after
+        return random.uniform(
+            0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def call(self, company, fn, idempotent=True, retried=None):
+        """
+        Return fn(), within the limits for 'company' and retrying it on
+        retryable errors.  retried(error) is called before each retry.
+        """
+        limit = self._limit(company)
+        attempt = 0
+        while True:
+            try:
+                with limit:
+                    return fn()
+            except Exception as e:
+                if attempt >= self.retries or \
+                        not self.retryable(e, idempotent):
+                    raise
+                delay = self.delay(attempt, e)
+                log.debug("Retrying in %.2fs after: %s", delay, e)
+                if retried is not None:
+                    retried(e)
+                if self.throttled(e) and limit.bucket is not None:
+                    # Hold back the other calls to the company as well;
+                    # this one waits for the bucket when it is retried.
+                    limit.bucket.pause(delay)
+                else:
+                    time.sleep(delay)
+                attempt += 1
@@ -0,0 +1,214 @@
+"""
+intacct.session
+~~~~~~~~~~~~~~~
+
+Pools of API sessions shared between workers and, optionally, between
+processes through an encrypted file per set of credentials.
+
+"""
+
+try:
+    import xml.etree.cElementTree as ET
+except ImportError:
+    import xml.etree.ElementTree as ET
+
+import base64
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+log = logging.getLogger(__name__)
+from .compat import replace
+from .default import session_dir, session_lifetime, session_pool_size
+from .exceptions import AuthenticationError
+
+
+class ApiSession(object):
+    """
+    A session id and endpoint along with the request template using them.
+    Sessions expire after 'session_lifetime' seconds without use.
+    """
+    def __init__(self, sessionid, endpoint, expires=None):
+        self.sessionid = sessionid
+        self.endpoint = endpoint
+        self.expires = expires or time.time() + session_lifetime
+        self.template = None
+        self.used = expires is not None
+
+    @property
+    def expired(self):
+        return self.expires <= time.time()
+
+    def touch(self):
+        self.expires = time.time() + session_lifetime
+        self.used = True
+
+
+class _Pool(object):
+    def __init__(self, sessions):
+        self.idle = sessions
+        self.busy = 0
+        self.saved = 0
+        self.dirty = False
+
+
+class SessionManager(object):
+    """
+    Hands out sessions to the callers of an IntacctApi, up to 'size' per
+    set of credentials, each used by one call at a time.  Sessions are
+    created on demand and dropped when they expire or the gateway rejects
+    them.  When 'persist' is set, the sessions are shared with other
+    processes through a file per set of credentials in 'path', encrypted
+    with a key derived from the credentials (this requires the
+    'cryptography' package).
+
+        api = IntacctApi(..., sessions=SessionManager(persist=True))
+    """
+    def __init__(self, size=None, persist=False, path=None):
+        self.size = size or session_pool_size
+        self.persist = persist
+        self.path = path or os.path.join(os.path.expanduser("~"), session_dir)
+        self.pools = {}
+        self.keys = {}
+        self.condition = threading.Condition()
+        if persist:
+            # Fail early if encryption is not available.
+            from cryptography.fernet import Fernet
+            self.fernet = Fernet
+
+    def _pool(self, request):
+        pool = self.pools.get(request.key)
+        if pool is None:
+            sessions = [s for s in self._load(request) if not s.expired]
+            pool = self.pools[request.key] = _Pool(sessions)
+        return pool
+
+    @contextmanager
+    def acquire(self, api):
+        """
+        Context manager lending a session for the credentials of 'api',
+        logging in if none is idle and the pool is not full.  A session
+        rejected by the gateway (AuthenticationError) is dropped.
+        """
+        request = api.request
+        with self.condition:
+            pool = self._pool(request)
+            while True:
+                while pool.idle and pool.idle[-1].expired:
+                    pool.idle.pop()
+                    pool.dirty = True
+                if pool.idle or pool.busy < self.size:
+                    break
+                self.condition.wait()
+            session = pool.idle.pop() if pool.idle else None
+            pool.busy += 1
+        try:
+            if session is None:
+                session = self._login(api)
+                pool.dirty = True
+            if session.template is None:
+                session.template = request.session_template(
+                    session.sessionid, session.endpoint)
+            yield session
+        except AuthenticationError:
+            self._release(request, None)
+            raise
+        except BaseException:
+            self._release(request, session)
+            raise
+        else:
+            session.touch()
+            self._release(request, session)
+
+    def _release(self, request, session):
+        with self.condition:
+            pool = self.pools[request.key]
+            pool.busy -= 1
+            if session is not None:
+                pool.idle.append(session)
+            else:
+                pool.dirty = True
+            self.condition.notify()
+            # Refresh the file when sessions come or go, and periodically
+            # so that other processes see up to date expiry times.
+            if self.persist and (pool.dirty or
+                                 pool.saved + 60 < time.time()):
+                self._save(request, pool)
+
+    def call(self, api, fn):
+        """
+        Call fn(template) with the template of a pooled session.  If the
+        gateway rejects a session which had been used before (it expired
+        or was revoked), the session is dropped and the call retried with
+        another one; only a rejected new session is an error.
+        """
+        while True:
+            used = False
+            try:
+                with self.acquire(api) as session:
+                    used = session.used
+                    return fn(session.template)
+            except AuthenticationError:
+                if not used:
+                    raise
+                log.debug("Session rejected, retrying with another session")
+
+    def _login(self, api):
+        xml = api.request(ET.Element('getAPISession'), api.request.login)
+        sessionid = xml.findtext('operation/result/data/api/sessionid')
+        endpoint = xml.findtext('operation/result/data/api/endpoint')
+        if not sessionid or not endpoint:
+            raise Exception("Failed to find 'sessionid' and 'endpoint'")
+        log.debug("Obtained session id: %s, Using endpoint: %s",
+                  sessionid, endpoint)
+        return ApiSession(sessionid, endpoint)
+
+    def _file(self, request):
+        name = hashlib.sha256(
+            '\0'.join(request.key).encode('utf-8')).hexdigest()
+        return os.path.join(self.path, name)
+
+    def _key(self, request):
+        key = self.keys.get(request.key)
+        if key is None:
+            salt = os.path.basename(self._file(request)).encode('ascii')
+            secret = hashlib.pbkdf2_hmac(
+                'sha256', request.secret.encode('utf-8'), salt, 100000)
+            key = self.keys[request.key] = self.fernet(
+                base64.urlsafe_b64encode(secret))
+        return key
+
+    def _load(self, request):
+        if not self.persist:
+            return []
+        try:
+            with open(self._file(request), 'rb') as f:
+                token = f.read()
+            sessions = json.loads(
+                self._key(request).decrypt(token).decode('utf-8'))
+        except Exception:
+            return []
+        return [ApiSession(s['sessionid'], s['endpoint'], s['expires'])
+                for s in sessions]
+
+    def _save(self, request, pool):
+        sessions = [
+            {'sessionid': s.sessionid, 'endpoint': s.endpoint,
+             'expires': s.expires}
+            for s in pool.idle if not s.expired
+        ]
+        token = self._key(request).encrypt(
+            json.dumps(sessions).encode('utf-8'))
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path, 0o700)
+        path = self._file(request)
+        tmp = '%s.%d' % (path, os.getpid())
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(token)
+        replace(tmp, path)
+        pool.saved = time.time()
+        pool.dirty = False
@@ -0,0 +1,318 @@
+"""
+intacct.sync
+~~~~~~~~~~~~
+
+Incremental copies of Intacct objects in a local SQLite database.
+
+"""
+
+import logging
+import sqlite3
+import time
+from datetime import datetime, timedelta
+log = logging.getLogger(__name__)
+from .bulk import chunked
+from .columns import FLOAT_TYPES, INT_TYPES, schema
+from . import default
+from .default import page_size
+
+# Format of WHENMODIFIED and other timestamps in queries and results
+TIMESTAMP = '%m/%d/%Y %H:%M:%S'
+# Format of dates in queries and results
+DATE = '%m/%d/%Y'
+# Formats in which timestamps and dates are stored, which sort in order
+ISO_TIMESTAMP = '%Y-%m-%d %H:%M:%S'
+ISO_DATE = '%Y-%m-%d'
+# Conversions of fields to the stored formats, by externalDataName
+ISO_FORMATS = {'timestamp': (TIMESTAMP, ISO_TIMESTAMP),
+               'date': (DATE, ISO_DATE)}
+
+WATERMARKS = """
+CREATE TABLE IF NOT EXISTS _watermarks (
+    object TEXT PRIMARY KEY,
+    modified TEXT,
+    key INTEGER,
+    synced REAL,
+    reconciled REAL
+)
+"""
+
+
+def _quote(name):
+    return '"%s"' % name.replace('"', '""')
+
+
+def _affinity(fields, name):
+    datatype = _field(fields, name).get('externalDataName')
+    if datatype in FLOAT_TYPES:
+        return 'REAL'
+    if datatype in INT_TYPES:
+        return 'INTEGER'
+    return 'TEXT'
+
+
+def _iso(text, formats):
+    """
+    Return 'text' converted from the first to the second of 'formats', or
+    unchanged if it is not in the first.
+    """
+    try:
+        return datetime.strptime(text, formats[0]).strftime(formats[1])
+    except (TypeError, ValueError):
+        return text
+
+
+def _field(fields, name):
+    field = fields
+    for part in name.split('.'):
+        field = field.get(part) or {}
+    return field
+
+
+def _timestamp(text):
+    """
+    Parse a watermark, stored in ISO_TIMESTAMP (or, by earlier versions,
+    TIMESTAMP) format.
+    """
+    try:
+        return datetime.strptime(text, ISO_TIMESTAMP)
+    except ValueError:
+        return datetime.strptime(text, TIMESTAMP)
+
+
+def flatten(record):
+    """
+    Return a dict of the fields of a record element.  Fields of nested
+    objects are named 'OBJECT.FIELD'.
+    """
+    values = {}
+    for child in record:
+        if len(child):
+            for sub in child:
+                values[child.tag + '.' + sub.tag] = sub.text
+        else:
+            values[child.tag] = child.text
+    return values
+
+
+class Mirror(object):
+    """
+    Keeps a table per object in a SQLite database up to date with the
+    gateway.  Each sync() only reads the records modified since the
+    previous one (by 'modified', less 'overlap' seconds to allow for
+    clock skew and slow transactions) and inserts or replaces them by
+    'key'.  Objects without a modification time are synced by 'key'
+    alone, which picks up new records only.  Deleted records are found by
+    reconcile(), which compares every key and which sync() runs once
+    'reconcile_interval' seconds have passed since the last time.
+
+        mirror = Mirror(api, 'intacct.db', indexes={'VENDOR': ['VENDORID']})
+        mirror.sync('VENDOR')
+        mirror.records('VENDOR', 'STATUS = ?', ('active',))
+
+    Columns are added as new fields show up, typed from the ObjectCache
+    when the object is in it.  'modified', and the timestamp and date
+    fields of the ObjectCache, are stored as ISO_TIMESTAMP and ISO_DATE
+    so that they sort in time order.  A Mirror must only be used by the thread
+    which created it.
+    """
+    def __init__(self, api, path, indexes=None, key='RECORDNO',
+                 modified='WHENMODIFIED', overlap=None,
+                 reconcile_interval=None):
+        self.api = api
+        self.connection = sqlite3.connect(path)
+        self.connection.row_factory = sqlite3.Row
+        self.indexes = indexes or {}
+        self.key = key
+        self.modified = modified
+        self.overlap = default.sync_overlap if overlap is None else overlap
+        self.reconcile_interval = default.reconcile_interval \
+            if reconcile_interval is None else reconcile_interval
+        self.columns = {}
+        self.formats = {}
+        with self.connection:
+            self.connection.execute(WATERMARKS)
+
+    def close(self):
+        self.connection.close()
+
+    def _table(self, obj):
+        """
+        Create the table and indexes for 'obj' if needed and return the
+        set of its column names.
+        """
+        columns = self.columns.get(obj)
+        if columns is not None:
+            return columns
+        table = _quote(obj)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS %s (%s INTEGER PRIMARY KEY)' % (
+                table, _quote(self.key)))
+        columns = self.columns[obj] = set(
+            row[1] for row in
+            self.connection.execute('PRAGMA table_info(%s)' % table))
+        fields = self.indexes.get(obj, [])
+        if self.modified:
+            fields = [self.modified] + list(fields)
+        self._add_columns(obj, fields)
+        for field in fields:
+            self.connection.execute(
+                'CREATE INDEX IF NOT EXISTS %s ON %s (%s)' % (
+                    _quote('%s_%s' % (obj, field)), table, _quote(field)))
+        return columns
+
+    def _add_columns(self, obj, names):
+        columns = self.columns[obj]
+        fields = None
+        for name in names:
+            if name in columns:
+                continue
+            if fields is None:
+                fields = schema(obj) or {}
+            self.connection.execute('ALTER TABLE %s ADD COLUMN %s %s' % (
+                _quote(obj), _quote(name), _affinity(fields, name)))
+            columns.add(name)
+
+    def _formats(self, obj, names):
+        """
+        Return (name, formats) pairs for the fields in 'names' stored as
+        ISO timestamps or dates (see ISO_FORMATS).
+        """
+        known = self.formats.setdefault(obj, {})
+        fields = None
+        for name in names:
+            if name in known:
+                continue
+            if fields is None:
+                fields = schema(obj) or {}
+            datatype = 'timestamp' if name == self.modified else \
+                _field(fields, name).get('externalDataName')
+            known[name] = ISO_FORMATS.get(datatype)
+        return [(name, known[name]) for name in names if known[name]]
+
+    def watermark(self, obj):
+        """
+        Return the row of '_watermarks' for 'obj', or None before the first
+        sync.
+        """
+        return self.connection.execute(
+            'SELECT * FROM _watermarks WHERE object = ?', (obj,)).fetchone()
+
+    def _delta(self, obj, query):
+        """
+        Return the query for the records changed since the last sync.
+        """
+        mark = self.watermark(obj)
+        conditions = [query] if query else []
+        if mark is not None and self.modified and mark['modified']:
+            since = _timestamp(mark['modified']) - \
+                timedelta(seconds=self.overlap)
+            conditions.append("%s >= '%s'" % (
+                self.modified, since.strftime(TIMESTAMP)))
+        elif mark is not None and mark['key'] is not None:
+            conditions.append('%s > %d' % (self.key, mark['key']))
+        if len(conditions) > 1:
+            conditions = ['(%s)' % c for c in conditions]
+        return ' AND '.join(conditions) or None
+
+    def sync(self, obj, query=None, fields=None, reconcile=None):
+        """
+        Bring the table of 'obj' up to date and return a dict with the
+        number of records 'upserted' and 'deleted'.
+
+        Keyword arguments:
+        query          - Only mirror the records matching this query.  It
+                         must be the same on every sync of the object.
+        fields         - A comma separated list of fields to mirror; it
+                         must include the key and modification time.
+        reconcile      - True or False to force or skip the reconciliation
+                         of deleted records.
+        """
+        mark = self.watermark(obj)
+        if reconcile is None:
+            reconciled = mark['reconciled'] if mark is not None else None
+            reconcile = mark is not None and (
+                reconciled is None or
+                time.time() - reconciled >= self.reconcile_interval)
+        delta = self._delta(obj, query)
+        latest = mark['modified'] if mark is not None else None
+        latest = latest and _timestamp(latest)
+        top = mark['key'] if mark is not None else None
+        upserted = 0
+        with self.connection:
+            columns = self._table(obj)
+            records = self.api.iter_by_query(
+                obj, query=delta, fields=fields or '*')
+            for chunk in chunked((flatten(r) for r in records), page_size):
+                names = set()
+                for values in chunk:
+                    names.update(values)
+                self._add_columns(obj, sorted(names - columns))
+                names = sorted(names)
+                formats = self._formats(obj, names)
+                for values in chunk:
+                    for name, conversion in formats:
+                        if values.get(name):
+                            values[name] = _iso(values[name], conversion)
+                self.connection.executemany(
+                    'INSERT OR REPLACE INTO %s (%s) VALUES (%s)' % (
+                        _quote(obj), ', '.join(map(_quote, names)),
+                        ', '.join('?' * len(names))),
+                    [[values.get(name) for name in names]
+                     for values in chunk])
+                upserted += len(chunk)
+                for values in chunk:
+                    key = values.get(self.key)
+                    if key:
+                        top = max(top, int(key)) if top is not None \
+                            else int(key)
+                    modified = self.modified and values.get(self.modified)
+                    if modified:
+                        modified = _timestamp(modified)
+                        latest = max(latest, modified) if latest else modified
+            self.connection.execute(
+                'INSERT OR REPLACE INTO _watermarks VALUES (?, ?, ?, ?, ?)',
+                (obj, latest and latest.strftime(ISO_TIMESTAMP), top,
+                 time.time(),
+                 mark['reconciled'] if mark is not None else time.time()))
+        log.debug("Synced %d records of %s", upserted, obj)
+        deleted = self.reconcile(obj, query) if reconcile else 0
+        return {'upserted': upserted, 'deleted': deleted}
+
+    def reconcile(self, obj, query=None):
+        """
+        Delete the records of 'obj' which no longer exist on the gateway
+        (or no longer match 'query') and return how many were deleted.
+        Only the keys of the records are read.
+        """
+        with self.connection:
+            self._table(obj)
+            self.connection.execute(
+                'CREATE TEMP TABLE IF NOT EXISTS _keys '
+                '(key INTEGER PRIMARY KEY)')
+            self.connection.execute('DELETE FROM _keys')
+            records = self.api.iter_by_query(
+                obj, query=query, fields=self.key)
+            keys = (r.findtext(self.key) for r in records)
+            for chunk in chunked(((int(k),) for k in keys if k), page_size):
+                self.connection.executemany(
+                    'INSERT OR IGNORE INTO _keys VALUES (?)', chunk)
+            deleted = self.connection.execute(
+                'DELETE FROM %s WHERE %s NOT IN (SELECT key FROM _keys)' % (
+                    _quote(obj), _quote(self.key))).rowcount
+            self.connection.execute('DELETE FROM _keys')
+            self.connection.execute(
+                'UPDATE _watermarks SET reconciled = ? WHERE object = ?',
+                (time.time(), obj))
+        log.debug("Deleted %d records of %s", deleted, obj)
+        return deleted
+
+    def records(self, obj, where=None, params=()):
+        """
+        Return the mirrored records of 'obj' matching the SQL condition
+        'where' as a list of sqlite3.Row.
+        """
+        sql = 'SELECT * FROM %s' % _quote(obj)
+        if where:
+            sql += ' WHERE ' + where
+        return self.connection.execute(sql, params).fetchall()
@@ -3,4 +3,4 @@ class IntacctObjectType(object):
     The purpose of this class is to serve as a base type for identifying
     Intacct objects using isinstance().
     """
-    pass
+    __slots__ = ()
@@ -0,0 +1,134 @@
+"""
+intacct.validation
+~~~~~~~~~~~~~~~~~~
+
+Client side checks of records against the field attributes stored in the
+ObjectCache (isRequired, isReadOnly and maxLength), so that records the
+gateway would reject are found before they are sent.
+
+"""
+
+import logging
+import threading
+log = logging.getLogger(__name__)
+from .exceptions import ValidationError
+
+# Read-only fields which identify the record to update
+key_fields = ('RECORDNO',)
+
+
+def _fields(properties):
+    return sorted(
+        (name, field) for name, field in properties.items()
+        if type(field) is dict and not name.startswith('_'))
+
+
+class Validator(object):
+    """
+    Checks record elements of one object type.  The checks are compiled
+    once from the ObjectCache entry 'properties':
+
+    - on 'create', required fields which are not read-only must be set;
+    - read-only fields must not be set, except 'key_fields' on 'update';
+    - values must be no longer than maxLength (when not 0).
+
+    Fields of nested objects are checked the same way when the nested
+    object is present.  Fields unknown to the cache are not checked.
+    """
+    def __init__(self, properties):
+        self.required = []
+        self.readonly = set()
+        self.limits = {}
+        self.nested = {}
+        for name, field in _fields(properties):
+            # The fields of nested objects are marked '_nested' too.
+            if field.get('_nested') and _fields(field):
+                self.nested[name] = Validator(field)
+                continue
+            readonly = field.get('isReadOnly') == 'true'
+            if readonly:
+                self.readonly.add(name)
+            elif field.get('isRequired') == 'true':
+                self.required.append(name)
+            try:
+                limit = int(field.get('maxLength') or 0)
+            except ValueError:
+                limit = 0
+            if limit > 0:
+                self.limits[name] = limit
+
+    def __call__(self, el, mode='create', prefix=''):
+        """
+        Return a list of (field, message) pairs for the problems of the
+        record element 'el' for a 'create' or an 'update'.
+        """
+        problems = []
+        present = set()
+        for child in el:
+            name = child.tag
+            nested = self.nested.get(name)
+            if nested is not None:
+                if len(child):
+                    present.add(name)
+                    problems.extend(
+                        nested(child, mode, prefix + name + '.'))
+                continue
+            text = child.text
+            if not text:
+                continue
+            present.add(name)
+            if name in self.readonly and not (
+                    mode == 'update' and name in key_fields):
+                problems.append((prefix + name, 'is read-only'))
+            limit = self.limits.get(name)
+            if limit is not None and len(text) > limit:
+                problems.append((
+                    prefix + name,
+                    'is longer than %d characters' % limit))
+        if mode == 'create':
+            problems.extend(
+                (prefix + name, 'is required')
+                for name in self.required if name not in present)
+        return problems
+
+    def check(self, el, mode='create'):
+        """
+        Raise a ValidationError if the record element 'el' has problems.
+        """
+        problems = self(el, mode)
+        if problems:
+            raise ValidationError(el.tag, problems)
+
+
+class _Validators(object):
+    """
+    Process wide Validators by object name, compiled on first use from the
+    shared ObjectCache and discarded when it is reloaded.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.cache = None
+        self.validators = {}
+
+    def get(self, name):
+        """
+        Return the Validator for object 'name', or None if the object is
+        not in the ObjectCache.
+        """
+        from .objcache import shared_cache
+        with self.lock:
+            cache = shared_cache()
+            if cache is not self.cache:
+                self.cache = cache
+                self.validators = {}
+            try:
+                return self.validators[name]
+            except KeyError:
+                pass
+            properties = cache.get(name) or cache.get(name.upper())
+            validator = self.validators[name] = \
+                Validator(properties) if properties else None
+            return validator
+
+
+validators = _Validators()
@@ -29,7 +29,12 @@ setup(
     },
     install_requires=[
         'requests',
+        'futures; python_version < "3"',
     ],
+    extras_require={
+        'async': ['aiohttp'],
+        'sessions': ['cryptography'],
+    },
     classifiers=[
         'Intended Audience :: Developers',
         'License :: OSI Approved :: MIT License',